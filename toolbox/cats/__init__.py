@@ -1 +1,4 @@
 from .match import *
+from .index import CatalogIndex
+from .result import MatchResult
+from .stream import *
@@ -0,0 +1,203 @@
+"""
+Persistent spatial index for matching against the same reference
+catalog many times.
+"""
+import os
+import json
+import numpy as np
+from .zones import ZoneIndex, DEFAULT_CHUNK_SIZE
+
+__all__ = ['CatalogIndex']
+
+
+class CatalogIndex(object):
+    """
+    Zone index of a reference catalog that can be saved to disk,
+    memory-mapped back in, and extended with new rows without a full
+    rebuild. It can be passed to match_coordinates and crossmatch in
+    place of the catalog coordinates.
+
+    The index stores the unit vectors of the catalog sorted by
+    (declination zone, ra), along with the sort keys and the original
+    row numbers. These are plain arrays, so loading a saved index only
+    memory-maps the files. Appended rows go into a new segment, which
+    is searched together with the others; compact() merges the
+    segments into one.
+
+    Parameters
+    ----------
+    ra : ndarray
+        Right ascensions in degrees.
+    dec : ndarray
+        Declinations in degrees.
+    zone_height : float, optional
+        Height of the declination zones in degrees. Matching is
+        fastest when this is within a factor of a few of the
+        typical match radius.
+    max_segments : int, optional
+        Compact the index once appending makes more segments
+        than this.
+
+    Examples
+    --------
+    >>> index = CatalogIndex(ref['ra'], ref['dec'])
+    >>> index.save('ref-index')
+    >>> index = CatalogIndex.load('ref-index')
+    >>> mask, idx = match_coordinates(coords, index, 1.0)
+    """
+
+    def __init__(self, ra, dec, zone_height=1.0/60.0, max_segments=8):
+        self.zone_height = zone_height
+        self.max_segments = max_segments
+        self.segments = []
+        self.offsets = []
+        self._saved = []
+        self.append(ra, dec)
+
+    @property
+    def size(self):
+        """Total number of rows in the index."""
+        return sum(seg.size for seg in self.segments)
+
+    def __len__(self):
+        return self.size
+
+    def append(self, ra, dec):
+        """
+        Add rows to the index. Their indices continue from the current
+        size of the index. Only the new rows are sorted.
+        """
+        offset = self.size
+        self.segments.append(ZoneIndex(ra, dec, self.zone_height))
+        self.offsets.append(offset)
+        self._saved.append(False)
+        if len(self.segments) > self.max_segments:
+            self.compact()
+
+    def compact(self):
+        """
+        Merge all segments into one. Each segment is already sorted,
+        so this is a merge of sorted runs rather than a rebuild.
+        """
+        if len(self.segments) < 2:
+            return
+        keys = np.concatenate([seg.keys for seg in self.segments])
+        order = np.concatenate([np.asarray(seg.order) + offset for seg, offset
+                                in zip(self.segments, self.offsets)])
+        xyz = np.concatenate([seg.xyz for seg in self.segments])
+        merge = np.argsort(keys, kind='stable')
+        self.segments = [ZoneIndex.from_arrays(
+            keys[merge], order[merge], xyz[merge], self.zone_height)]
+        self.offsets = [0]
+        self._saved = [False]
+
+    def pairs(self, ra, dec, maxsep, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Find all (query, catalog) pairs within maxsep degrees.
+        See ZoneIndex.pairs.
+        """
+        for seg, offset in zip(self.segments, self.offsets):
+            for i, j, d2 in seg.pairs(ra, dec, maxsep, chunk_size):
+                yield i, j + offset, d2
+
+    def nearest(self, ra, dec, maxsep, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Nearest catalog row to each query point within maxsep
+        degrees. See ZoneIndex.nearest.
+        """
+        idx, sep = self.segments[0].nearest(ra, dec, maxsep, chunk_size)
+        for seg, offset in zip(self.segments[1:], self.offsets[1:]):
+            seg_idx, seg_sep = seg.nearest(ra, dec, maxsep, chunk_size)
+            better = seg_sep < sep
+            idx[better] = seg_idx[better] + offset
+            sep[better] = seg_sep[better]
+        return idx, sep
+
+    def _dec_slice(self, lo, hi):
+        """
+        Index of only the rows in the declination zones overlapping
+        [lo, hi] degrees. The zones are contiguous in the sorted arrays,
+        so the segments are views, and row indices are unchanged.
+        """
+        sub = self.__class__.__new__(self.__class__)
+        sub.zone_height = self.zone_height
+        sub.max_segments = self.max_segments
+        sub.offsets = list(self.offsets)
+        sub.segments = []
+        for seg in self.segments:
+            eps = 4.0*np.spacing(seg._zone(90.0)*360.0 + 360.0)
+            klo = seg._zone(max(lo, -90.0))*360.0 - eps
+            khi = (seg._zone(min(hi, 90.0)) + 1.0)*360.0 + eps
+            start, stop = np.searchsorted(seg.keys, [klo, khi])
+            sub.segments.append(ZoneIndex.from_arrays(
+                seg.keys[start:stop], seg.order[start:stop],
+                seg.xyz[start:stop], seg.zone_height))
+        sub._saved = [False]*len(sub.segments)
+        return sub
+
+    def save(self, path):
+        """
+        Write the index to the directory path. If the index was loaded
+        from path, only segments appended since then are written.
+        """
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        if getattr(self, 'path', None)!=path:
+            self._saved = [False]*len(self.segments)
+        names = []
+        for num, seg in enumerate(self.segments):
+            name = 'segment-{}-{}'.format(self.offsets[num], seg.size)
+            names.append(name)
+            if self._saved[num]:
+                continue
+            for attr in ['keys', 'order', 'xyz']:
+                fn = os.path.join(path, name+'-'+attr+'.npy')
+                np.save(fn, np.asarray(getattr(seg, attr)))
+            self._saved[num] = True
+        meta = dict(zone_height=self.zone_height, max_segments=self.max_segments,
+                    segments=names, offsets=self.offsets)
+        with open(os.path.join(path, 'index.json'), 'w') as file:
+            json.dump(meta, file)
+        self._remove_stale(path, names)
+        self.path = path
+
+    @staticmethod
+    def _remove_stale(path, names):
+        for fn in os.listdir(path):
+            if fn.startswith('segment-') and fn.rsplit('-', 1)[0] not in names:
+                os.remove(os.path.join(path, fn))
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Load an index written by save.
+
+        Parameters
+        ----------
+        path : string
+            Directory of the saved index.
+        mmap : bool, optional
+            If True, memory-map the arrays rather than reading
+            them into memory.
+
+        Returns
+        -------
+        index : CatalogIndex
+        """
+        with open(os.path.join(path, 'index.json')) as file:
+            meta = json.load(file)
+        mmap_mode = 'r' if mmap else None
+        index = cls.__new__(cls)
+        index.zone_height = meta['zone_height']
+        index.max_segments = meta['max_segments']
+        index.offsets = meta['offsets']
+        index.segments = []
+        for name in meta['segments']:
+            arrays = [np.load(os.path.join(path, name+'-'+attr+'.npy'),
+                              mmap_mode=mmap_mode)
+                      for attr in ['keys', 'order', 'xyz']]
+            index.segments.append(ZoneIndex.from_arrays(*arrays,
+                                  zone_height=index.zone_height))
+        index._saved = [True]*len(index.segments)
+        index.path = path
+        return index
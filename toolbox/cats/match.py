@@ -1,9 +1,200 @@
+from collections import namedtuple
 import numpy as np
+from .zones import ZoneIndex, chord_to_deg
+from .index import CatalogIndex
+from .stripes import striped_nearest, striped_pairs
+from .result import MatchResult
+
+__all__ = ['match_coordinates', 'crossmatch', 'MatchCSR', 'self_match', 
+           'merge_catalogs']
+
+CONVERT = {'degree':1.0, 'arcsec':1./3600.0, 'radian':180.0/np.pi}
+ENGINES = ['astropy', 'zones']
+MODES = ['nearest', 'all', 'one-to-one']
+
+# one-to-one matching switches from vectorized rounds to a greedy sweep
+# once a round settles fewer than 1/SWEEP_FRACTION of the remaining pairs
+SWEEP_FRACTION = 64
+
+MatchCSR = namedtuple('MatchCSR', ['offsets', 'idx', 'sep2d'])
+MatchCSR.__doc__ = """
+All matches within maxsep in compressed sparse row layout. The matches
+of matchcoord[k] are idx[offsets[k]:offsets[k+1]], sorted by separation,
+with separations sep2d[offsets[k]:offsets[k+1]].
+"""
+
+
+def _coord_arrays(coord):
+    """
+    Return float64 ra and dec arrays in degrees given a
+    SkyCoord/frame or a (ra, dec) pair of arrays in degrees.
+    """
+    if isinstance(coord, (tuple, list)):
+        ra, dec = coord
+    else:
+        ra, dec = coord.spherical.lon.deg, coord.spherical.lat.deg
+    ra = np.asarray(ra, dtype=np.float64).ravel()
+    dec = np.asarray(dec, dtype=np.float64).ravel()
+    return ra, dec
+
+
+def _zone_catalog(catcoord):
+    """
+    CatalogIndex or (ra, dec) arrays of the catalog for the zones engine.
+    """
+    if isinstance(catcoord, CatalogIndex):
+        return catcoord
+    return _coord_arrays(catcoord)
+
+
+def _zone_nearest(ra, dec, catalog, maxsep_deg, zone_height, n_jobs):
+    if n_jobs > 1:
+        return striped_nearest(ra, dec, catalog, maxsep_deg, 
+                               zone_height or maxsep_deg, n_jobs)
+    if not isinstance(catalog, CatalogIndex):
+        catalog = ZoneIndex(*catalog, zone_height=zone_height or maxsep_deg)
+    return catalog.nearest(ra, dec, maxsep_deg)
+
+
+def _iter_zone_pairs(ra, dec, catalog, maxsep_deg, zone_height, n_jobs):
+    if n_jobs > 1:
+        return striped_pairs(ra, dec, catalog, maxsep_deg, 
+                             zone_height or maxsep_deg, n_jobs)
+    if not isinstance(catalog, CatalogIndex):
+        catalog = ZoneIndex(*catalog, zone_height=zone_height or maxsep_deg)
+    return catalog.pairs(ra, dec, maxsep_deg)
+
+
+def _zone_pairs(ra, dec, catalog, maxsep_deg, zone_height, n_jobs):
+    pairs = list(_iter_zone_pairs(ra, dec, catalog, maxsep_deg, 
+                                  zone_height, n_jobs))
+    if not pairs:
+        return np.zeros(0, int), np.zeros(0, int), np.zeros(0)
+    return [np.concatenate(p) for p in zip(*pairs)]
+
+
+def _all_pairs(matchcoord, catcoord, maxsep_deg, engine, zone_height, n_jobs):
+    """
+    Every (matchcoord, catcoord) pair closer than maxsep_deg. Returns 
+    the pair indices, separations in degrees, and the catalog sizes.
+    """
+    if engine=='zones':
+        ra, dec = _coord_arrays(matchcoord)
+        catalog = _zone_catalog(catcoord)
+        i, j, d2 = _zone_pairs(ra, dec, catalog, maxsep_deg, zone_height, n_jobs)
+        sep = chord_to_deg(d2)
+        n = len(ra)
+        ncat = len(catalog) if isinstance(catalog, CatalogIndex) else len(catalog[0])
+    else:
+        from astropy import units as u
+        from astropy.coordinates import search_around_sky
+        i, j, sep, _ = search_around_sky(matchcoord, catcoord, maxsep_deg*u.deg)
+        sep = sep.deg
+        n, ncat = matchcoord.size, catcoord.size
+    keep = sep < maxsep_deg
+    return i[keep], j[keep], sep[keep], n, ncat
+
+
+def _pairs_to_csr(i, j, sep, n):
+    """
+    Sort pairs by (i, sep, j) and build the CSR offsets.
+    """
+    order = np.lexsort((j, sep, i))
+    offsets = np.zeros(n+1, dtype=np.int64)
+    np.cumsum(np.bincount(i, minlength=n), out=offsets[1:])
+    return offsets, j[order], sep[order]
+
+
+def _greedy_sweep(i, j, rank, idx, best, sep, used_j):
+    """
+    Accept pairs one at a time in order of rank, skipping those 
+    with an already matched member.
+    """
+    used_i = bytearray((idx >= 0).astype(np.uint8).tobytes())
+    taken_j = bytearray(used_j.astype(np.uint8).tobytes())
+    order = np.argsort(rank, kind='stable')
+    accept = []
+    for num, ii, jj in zip(order.tolist(), i[order].tolist(), j[order].tolist()):
+        if not used_i[ii] and not taken_j[jj]:
+            used_i[ii] = taken_j[jj] = 1
+            accept.append(num)
+    accept = np.array(accept, dtype=np.int64)
+    idx[i[accept]] = j[accept]
+    best[i[accept]] = sep[accept]
+
+
+def _one_to_one(i, j, sep, n, ncat):
+    """
+    Resolve pairs into one-to-one matches, globally in order of 
+    increasing separation. This gives the same result as greedily 
+    accepting pairs from the smallest separation up, but is done in 
+    vectorized rounds: a pair is accepted when it is the best remaining 
+    pair of both of its members, and pairs of matched objects are 
+    then dropped. Ties are broken by index.
+
+    Each round settles at least one pair, and usually most of them, 
+    but on chains of objects whose separations shrink along the chain 
+    only one pair per chain is settled per round. Once a round accepts 
+    fewer than 1/SWEEP_FRACTION of the remaining pairs, the rest are 
+    resolved by a sequential greedy sweep in order of separation, so 
+    the worst case is a sort plus a Python loop over the remaining 
+    pairs (~1 s per million pairs) rather than one round per pair.
+    """
+    rank = np.empty(len(i), dtype=np.int64)
+    rank[np.lexsort((j, i, sep))] = np.arange(len(i))
+    idx = np.full(n, -1, dtype=np.int64)
+    best = np.full(n, -1.0)
+    npairs = len(i)
+    best_i = np.empty(n, dtype=np.int64)
+    best_j = np.empty(ncat, dtype=np.int64)
+    used_j = np.zeros(ncat, dtype=bool)
+    while len(i) > 0:
+        best_i[i] = npairs
+        best_j[j] = npairs
+        np.minimum.at(best_i, i, rank)
+        np.minimum.at(best_j, j, rank)
+        accept = (rank==best_i[i]) & (rank==best_j[j])
+        idx[i[accept]] = j[accept]
+        best[i[accept]] = sep[accept]
+        used_j[j[accept]] = True
+        nremain = len(i)
+        remain = (idx[i]==-1) & ~used_j[j]
+        i, j, sep, rank = i[remain], j[remain], sep[remain], rank[remain]
+        if len(i) > 0 and SWEEP_FRACTION*np.count_nonzero(accept) < nremain:
+            _greedy_sweep(i, j, rank, idx, best, sep, used_j)
+            break
+    return idx, best
+
+
+def _find(parent, i):
+    """
+    Roots of the union-find trees of the elements i.
+    """
+    root = parent[i]
+    while True:
+        up = parent[root]
+        if np.array_equal(up, root):
+            return root
+        root = up
+
+
+def _union(parent, i, j):
+    """
+    Merge the trees of each pair (i, j), hooking the larger root under 
+    the smaller one, so the root of every tree is its smallest element.
+    """
+    while len(i) > 0:
+        ri, rj = _find(parent, i), _find(parent, j)
+        # path compression for the pair members
+        parent[i], parent[j] = ri, rj
+        diff = ri != rj
+        i, j = np.minimum(ri[diff], rj[diff]), np.maximum(ri[diff], rj[diff])
+        np.minimum.at(parent, j, i)
 
-__all__ = ['match_coordinates', 'crossmatch']
 
 def match_coordinates(matchcoord, catcoord, maxsep, sep_units='arcsec', 
-                      return_seps=False):
+                      return_seps=False, engine='astropy', zone_height=None, 
+                      mode='nearest', n_jobs=1):
     """
     Match catalogs given ra and dec in degrees. This function 
     is essentially a wrapper for astropy's match_coordinates_sky, 
@@ -12,9 +203,12 @@ def match_coordinates(matchcoord, catcoord, maxsep, sep_units='arcsec',
     Parameters
     ----------
     matchcoord : BaseCoordinateFrame or SkyCoord (see astropy)
-        The coordinate(s) to match to the catalog.
-    catcoord : BaseCoordinateFrame or SkyCoord
-        The base catalog in which to search for matches. 
+        The coordinate(s) to match to the catalog. With the zones 
+        engine, this may also be a (ra, dec) tuple of arrays in degrees.
+    catcoord : BaseCoordinateFrame, SkyCoord, or CatalogIndex
+        The base catalog in which to search for matches. With the 
+        zones engine, this may also be a (ra, dec) tuple of arrays. 
+        A prebuilt CatalogIndex implies the zones engine.
     maxsep : float
         The maximum angular separation for which objects are 
         considered to be the same.
@@ -23,7 +217,30 @@ def match_coordinates(matchcoord, catcoord, maxsep, sep_units='arcsec',
     return_seps : bool, optional, default = False
         If True, return the angular separations between the
         matched objects in the catalogs.
-        
+    engine : string, optional, default = 'astropy'
+        'astropy' uses astropy's match_coordinates_sky (a KD-tree 
+        on SkyCoord objects). 'zones' partitions the sky into 
+        declination zones and works directly on float64 ra/dec 
+        arrays, which uses much less memory and scales close to 
+        linearly with catalog size (see zones.py).
+    zone_height : float, optional
+        Height of the declination zones in degrees for the zones
+        engine. Default is maxsep.
+    mode : string, optional, default = 'nearest'
+        'nearest' matches each object to its nearest neighbour in 
+        catcoord, so several objects may claim the same catalog row. 
+        'one-to-one' resolves these conflicts globally by smallest 
+        separation, so every catalog row is matched at most once. 
+        This is vectorized, except for long chains of conflicting 
+        pairs, which in the worst case are resolved by a Python loop 
+        at ~1 s per million pairs. 
+        'all' returns every catalog object within maxsep as a 
+        MatchCSR (offsets, idx, sep2d) of flat arrays.
+    n_jobs : int, optional, default = 1
+        Number of processes. If greater than 1, the zones engine is 
+        used, with matchcoord split into declination stripes that are 
+        matched in parallel (see stripes.py). The results are the 
+        same as for n_jobs=1.
 
     Returns
     -------
@@ -34,21 +251,56 @@ def match_coordinates(matchcoord, catcoord, maxsep, sep_units='arcsec',
     sep2d : ndarray, optional
         The angular separations between the matches in units
         given by sep_units.
+
+    Note: With mode='all', the MatchCSR is returned instead, and 
+    its separations are in units given by sep_units.
     """
-    from astropy.coordinates import match_coordinates_sky
-    convert = {'degree':1.0, 'arcsec':1./3600.0, 'radian':180.0/np.pi}
-    idx, sep2d, sep3d = match_coordinates_sky(matchcoord, catcoord, nthneighbor=1)
-    mask = sep2d.value < (maxsep*convert[sep_units])
-    idx = idx[mask]
-    sep2d = sep2d.value[mask]/convert[sep_units]
+    assert engine in ENGINES, 'engine must be one of '+', '.join(ENGINES)
+    assert mode in MODES, 'mode must be one of '+', '.join(MODES)
+    if isinstance(catcoord, CatalogIndex) or n_jobs > 1:
+        engine = 'zones'
+    maxsep_deg = maxsep*CONVERT[sep_units]
+    if engine=='zones' and hasattr(matchcoord, 'frame') and\
+       hasattr(catcoord, 'transform_to'):
+        catcoord = catcoord.transform_to(matchcoord)
+    if mode!='nearest':
+        i, j, sep2d, n, ncat = _all_pairs(
+            matchcoord, catcoord, maxsep_deg, engine, zone_height, n_jobs)
+        if mode=='all':
+            offsets, idx, sep2d = _pairs_to_csr(i, j, sep2d, n)
+            return MatchCSR(offsets, idx, sep2d/CONVERT[sep_units])
+        idx, sep2d = _one_to_one(i, j, sep2d, n, ncat)
+        mask = idx >= 0
+        if hasattr(matchcoord, 'shape'):
+            mask = mask.reshape(matchcoord.shape)
+        idx = idx[mask.ravel()]
+        sep2d = sep2d[mask.ravel()]/CONVERT[sep_units]
+    elif engine=='zones':
+        ra, dec = _coord_arrays(matchcoord)
+        idx, sep2d = _zone_nearest(ra, dec, _zone_catalog(catcoord), 
+                                   maxsep_deg, zone_height, n_jobs)
+        mask = sep2d < maxsep_deg
+        if hasattr(matchcoord, 'shape'):
+            mask = mask.reshape(matchcoord.shape)
+        idx = idx.reshape(mask.shape)[mask]
+        sep2d = sep2d.reshape(mask.shape)[mask]/CONVERT[sep_units]
+    else:
+        from astropy.coordinates import match_coordinates_sky
+        idx, sep2d, sep3d = match_coordinates_sky(matchcoord, catcoord, nthneighbor=1)
+        mask = sep2d.value < maxsep_deg
+        idx = idx[mask]
+        sep2d = sep2d.value[mask]/CONVERT[sep_units]
     return (mask, idx) if not return_seps else (mask, idx, sep2d)
 
 
 def crossmatch(table_1, table_2, maxsep, sep_units='arcsec', return_seps=False, 
-               ra_colname='ra', dec_colname='dec'):
+               ra_colname='ra', dec_colname='dec', engine='astropy', 
+               mode='nearest', index=None, n_jobs=1, lazy=False):
     """
     Build astropy SkyCoord objects given two tables with ra and dec columns 
-    and match them using astropy's match_coordinates_sky function.
+    and match them using astropy's match_coordinates_sky function. With 
+    engine='zones', the ra and dec columns are matched directly without 
+    building SkyCoord objects.
 
     Parameters
     ----------
@@ -68,6 +320,23 @@ def crossmatch(table_1, table_2, maxsep, sep_units='arcsec', return_seps=False,
         The ra column name.
     dec_colname : string, optional
         The ra column name.
+    engine : string, optional, default = 'astropy'
+        Matching engine ('astropy' or 'zones'); see match_coordinates.
+    mode : string, optional, default = 'nearest'
+        Matching mode ('nearest', 'one-to-one', or 'all'); see 
+        match_coordinates. With 'all', each pair within maxsep 
+        is a row of the matched tables.
+    index : CatalogIndex, optional
+        Prebuilt index of table_2's coordinates (in table_2's row 
+        order). If given, it is used for matching instead of the 
+        coordinate columns of table_2.
+    n_jobs : int, optional, default = 1
+        Number of processes for the zones engine; see 
+        match_coordinates.
+    lazy : bool, optional, default = False
+        If True, return a MatchResult that holds only the matched 
+        row indices and separations instead of copies of the tables. 
+        Columns are then read from the original tables on access.
         
     Returns
     -------
@@ -75,14 +344,208 @@ def crossmatch(table_1, table_2, maxsep, sep_units='arcsec', return_seps=False,
         Matched first catalog.
     matched_2 : numpy array with named columns (astropy Table)
         Matched second catalog.
+    result : MatchResult
+        Returned instead of the matched tables if lazy is True.
 
     Note: The shapes of matched_1 and matched_2 are the same and the 
     objects are (within the maxsep threshold) the same.
     """
     from astropy.coordinates import SkyCoord
 
+    if index is not None or n_jobs > 1:
+        engine = 'zones'
     cats = []
     for tab in [table_1, table_2]:
-        cats.append(SkyCoord(tab[ra_colname], tab[dec_colname], frame='icrs', unit='deg'))
-    mask, idx, sep2d = match_coordinates(cats[0], cats[1], maxsep, sep_units, True)
+        if tab is table_2 and index is not None:
+            cats.append(index)
+        elif engine=='zones':
+            cats.append((tab[ra_colname], tab[dec_colname]))
+        else:
+            cats.append(SkyCoord(tab[ra_colname], tab[dec_colname], frame='icrs', unit='deg'))
+    if mode=='all':
+        offsets, idx, sep2d = match_coordinates(
+            cats[0], cats[1], maxsep, sep_units, engine=engine, mode=mode, 
+            n_jobs=n_jobs)
+        mask = np.repeat(np.arange(len(table_1)), np.diff(offsets))
+    else:
+        mask, idx, sep2d = match_coordinates(
+            cats[0], cats[1], maxsep, sep_units, True, engine=engine, mode=mode, 
+            n_jobs=n_jobs)
+    if lazy:
+        rows = mask if mode=='all' else np.flatnonzero(mask)
+        return MatchResult(table_1, table_2, rows, idx, sep2d)
     return (table_1[mask], table_2[idx], sep2d) if return_seps else (table_1[mask], table_2[idx])
+
+
+def self_match(coord, linking_length, sep_units='arcsec', zone_height=None, 
+               n_jobs=1, return_pairs=False):
+    """
+    Group a catalog with itself using the friends-of-friends algorithm: 
+    any two objects closer than the linking length are linked, and the 
+    groups are the connected components, so chains of more than two 
+    detections of the same object end up in one group. 
+    
+    Pairs are found with the zones engine and merged chunk by chunk 
+    with a vectorized union-find, so no N x N structure is ever built.
+
+    Parameters
+    ----------
+    coord : BaseCoordinateFrame, SkyCoord, or (ra, dec) tuple of arrays
+        The catalog coordinates (ra and dec in degrees for a tuple).
+    linking_length : float
+        The maximum angular separation for which objects are linked.
+    sep_units : string, optional, default = 'arcsec'
+        Units of linking_length. (arcsec, degree, or radian)
+    zone_height : float, optional
+        Height of the declination zones in degrees. Default is 
+        the linking length.
+    n_jobs : int, optional, default = 1
+        Number of processes used to find pairs.
+    return_pairs : bool, optional, default = False
+        If True, also return the linked pairs.
+
+    Returns
+    -------
+    group_id : ndarray
+        Group number of each object, from 0 to (number of groups - 1), 
+        ordered by the first member of each group. Isolated objects 
+        get their own group.
+    pairs : tuple of ndarray, optional
+        The (i, j, sep) of all linked pairs with i < j, with sep in 
+        units given by sep_units.
+    """
+    ra, dec = _coord_arrays(coord)
+    maxsep_deg = linking_length*CONVERT[sep_units]
+    parent = np.arange(len(ra))
+    pairs = []
+    for i, j, d2 in _iter_zone_pairs(ra, dec, (ra, dec), maxsep_deg, 
+                                     zone_height, n_jobs):
+        keep = i < j
+        i, j, d2 = i[keep], j[keep], d2[keep]
+        sep = chord_to_deg(d2)
+        keep = sep < maxsep_deg
+        i, j = i[keep], j[keep]
+        _union(parent, i, j)
+        if return_pairs:
+            pairs.append((i, j, sep[keep]/CONVERT[sep_units]))
+    roots = _find(parent, np.arange(len(ra)))
+    group_id = np.unique(roots, return_inverse=True)[1].reshape(-1)
+    if not return_pairs:
+        return group_id
+    if pairs:
+        pairs = tuple(np.concatenate(p) for p in zip(*pairs))
+    else:
+        pairs = (np.zeros(0, int), np.zeros(0, int), np.zeros(0))
+    return group_id, pairs
+
+
+def merge_catalogs(coords, maxsep, sep_units='arcsec', names=None, 
+                   ra_colname='ra', dec_colname='dec', zone_height=None, 
+                   n_jobs=1):
+    """
+    Merge N catalogs (e.g., one SExtractor catalog per band) into a 
+    master source list in a single pass. All catalogs share one zone 
+    index; detections from different catalogs closer than maxsep are 
+    linked, and the master sources are the friends-of-friends groups. 
+    Unlike chained pairwise crossmatches, no tables are copied and the 
+    result does not depend on the order of the catalogs.
+
+    Parameters
+    ----------
+    coords : list
+        The N catalogs. Each may be an astropy Table with ra and dec 
+        columns, a SkyCoord/frame, or a (ra, dec) tuple of arrays.
+    maxsep : float
+        The maximum angular separation for which detections are 
+        considered to be the same source.
+    sep_units : string, optional, default = 'arcsec'
+        Units of maxsep. (arcsec, degree, or radian)
+    names : list of strings, optional
+        Catalog names (e.g., ['g', 'r', 'i']) used for the index 
+        columns. Default is 0, 1, ..., N-1.
+    ra_colname : string, optional
+        The ra column name for Table inputs.
+    dec_colname : string, optional
+        The dec column name for Table inputs.
+    zone_height : float, optional
+        Height of the declination zones in degrees. Default is maxsep.
+    n_jobs : int, optional, default = 1
+        Number of processes used to find pairs.
+
+    Returns
+    -------
+    master : astropy.table.Table
+        One row per source, sorted by ra and dec, with the mean 
+        position of its detections (ra, dec), the number of catalogs 
+        in which it was detected (ncat), its friends-of-friends group 
+        number (group), and an index column idx_<name> for each 
+        catalog (-1 if missing).
+
+    Note: If a group has several detections from the same catalog, 
+    the one closest to the group's mean position is assigned to the 
+    group's main source, and each of the others gets a source of its 
+    own with the same group number. Every detection therefore appears 
+    in exactly one row.
+    """
+    from astropy.table import Table
+    from .zones import radec_to_xyz
+
+    names = [str(n) for n in (names or range(len(coords)))]
+    ra, dec = [], []
+    for coord in coords:
+        if hasattr(coord, 'colnames'):
+            coord = (coord[ra_colname], coord[dec_colname])
+        coord_ra, coord_dec = _coord_arrays(coord)
+        ra.append(coord_ra)
+        dec.append(coord_dec)
+    sizes = [len(r) for r in ra]
+    cat = np.repeat(np.arange(len(coords)), sizes)
+    row = np.concatenate([np.arange(size) for size in sizes])
+    ra, dec = np.concatenate(ra), np.concatenate(dec)
+
+    # link detections from different catalogs
+    maxsep_deg = maxsep*CONVERT[sep_units]
+    parent = np.arange(len(ra))
+    for i, j, d2 in _iter_zone_pairs(ra, dec, (ra, dec), maxsep_deg, 
+                                     zone_height, n_jobs):
+        keep = (cat[i] != cat[j]) & (chord_to_deg(d2) < maxsep_deg)
+        _union(parent, i[keep], j[keep])
+    group = np.unique(_find(parent, np.arange(len(ra))), 
+                      return_inverse=True)[1].reshape(-1)
+    ngroup = group.max() + 1 if len(group) else 0
+
+    # mean position of each group
+    xyz = radec_to_xyz(ra, dec)
+    center = np.stack([np.bincount(group, xyz[:, k], ngroup) 
+                       for k in range(3)], axis=1)
+    center /= np.linalg.norm(center, axis=1)[:, None]
+    d2 = ((xyz - center[group])**2).sum(axis=1)
+
+    # closest detection from each catalog; other detections from the
+    # same catalog become sources of their own
+    key = group*len(coords) + cat
+    order = np.lexsort((row, d2, key))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = key[order][1:] != key[order][:-1]
+    source = np.empty(len(ra), dtype=np.int64)
+    source[order[first]] = group[order[first]]
+    extra = np.sort(order[~first])
+    source[extra] = ngroup + np.arange(len(extra))
+    nsource = ngroup + len(extra)
+
+    # mean position of the detections of each source
+    center = np.stack([np.bincount(source, xyz[:, k], nsource) 
+                       for k in range(3)], axis=1)
+    center /= np.linalg.norm(center, axis=1)[:, None]
+
+    master = Table()
+    master['ra'] = np.rad2deg(np.arctan2(center[:, 1], center[:, 0])) % 360.0
+    master['dec'] = np.rad2deg(np.arcsin(np.clip(center[:, 2], -1.0, 1.0)))
+    master['ncat'] = np.bincount(source, minlength=nsource)
+    master['group'] = np.concatenate([np.arange(ngroup), group[extra]])
+    for num, name in enumerate(names):
+        idx = np.full(nsource, -1, dtype=np.int64)
+        sel = cat==num
+        idx[source[sel]] = row[sel]
+        master['idx_'+name] = idx
+    return master[np.lexsort((master['dec'], master['ra']))]
@@ -0,0 +1,124 @@
+"""
+Index-only crossmatch results.
+"""
+import numpy as np
+
+__all__ = ['MatchResult']
+
+
+def _as_slice(idx):
+    """
+    Return a slice equivalent to the index array idx if it is a 
+    contiguous increasing run, so columns can be viewed without 
+    copying. Otherwise return idx.
+    """
+    if len(idx)==0:
+        return slice(0, 0)
+    start, stop = idx[0], idx[-1] + 1
+    if stop - start==len(idx) and np.all(np.diff(idx)==1):
+        return slice(start, stop)
+    return idx
+
+
+class MatchResult(object):
+    """
+    Lightweight join of two matched tables that holds only the row 
+    indices and separations of the matches. Columns are pulled from 
+    the original tables when they are accessed, as views where the 
+    matched rows are contiguous, so wide catalogs are never copied 
+    as a whole.
+
+    Parameters
+    ----------
+    table_1 : astropy.table.Table
+        The first catalog.
+    table_2 : astropy.table.Table
+        The second catalog.
+    idx_1 : ndarray
+        Row indices of the matches in table_1.
+    idx_2 : ndarray
+        Row indices of the matches in table_2.
+    sep2d : ndarray
+        The angular separations between the matches.
+
+    Examples
+    --------
+    >>> result = crossmatch(cat_1, cat_2, 1.0, engine='zones', lazy=True)
+    >>> mag_1, mag_2 = result.col_1('mag'), result.col_2('mag')
+    >>> result.write('matches.fits', columns_1=['id'], columns_2=['z'])
+    """
+
+    def __init__(self, table_1, table_2, idx_1, idx_2, sep2d):
+        self.table_1 = table_1
+        self.table_2 = table_2
+        self.idx_1 = np.asarray(idx_1)
+        self.idx_2 = np.asarray(idx_2)
+        self.sep2d = np.asarray(sep2d)
+
+    def __len__(self):
+        return len(self.idx_1)
+
+    def __repr__(self):
+        return '<MatchResult: {} matches>'.format(len(self))
+
+    def col_1(self, name):
+        """
+        Column name of table_1 for the matched rows.
+        """
+        return self.table_1[name][_as_slice(self.idx_1)]
+
+    def col_2(self, name):
+        """
+        Column name of table_2 for the matched rows.
+        """
+        return self.table_2[name][_as_slice(self.idx_2)]
+
+    def tables(self):
+        """
+        Materialize the matched rows of both tables, which is what 
+        crossmatch returns when lazy=False.
+        """
+        return (self.table_1[_as_slice(self.idx_1)], 
+                self.table_2[_as_slice(self.idx_2)])
+
+    def to_table(self, columns_1=None, columns_2=None, table_names=('1', '2'), 
+                 sep_colname='sep'):
+        """
+        Build a single joined Table with only the requested columns.
+
+        Parameters
+        ----------
+        columns_1, columns_2 : list, optional
+            Columns of table_1 and table_2 to include. Default is all.
+        table_names : tuple, optional
+            Suffixes added to column names found in both tables.
+        sep_colname : string, optional
+            Name of the separation column. If None, it is left out.
+
+        Returns
+        -------
+        joined : astropy.table.Table
+        """
+        from astropy.table import Table
+        if columns_1 is None:
+            columns_1 = self.table_1.colnames
+        if columns_2 is None:
+            columns_2 = self.table_2.colnames
+        joined = Table()
+        for columns, get, suffix, other in [
+                (columns_1, self.col_1, table_names[0], columns_2), 
+                (columns_2, self.col_2, table_names[1], columns_1)]:
+            for name in columns:
+                out = name+'_'+suffix if name in other else name
+                joined[out] = get(name)
+        if sep_colname is not None:
+            joined[sep_colname] = self.sep2d
+        return joined
+
+    def write(self, filename, columns_1=None, columns_2=None, **kwargs):
+        """
+        Write the joined columns to a file. Only the requested 
+        columns are materialized. Extra keyword arguments are passed 
+        to astropy's Table.write.
+        """
+        self.to_table(columns_1, columns_2).write(filename, **kwargs)
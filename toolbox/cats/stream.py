@@ -0,0 +1,229 @@
+"""
+Out-of-core crossmatching of catalog files. The match catalog is read
+in chunks and each chunk is matched against an index of the reference
+catalog, so peak memory is set by the chunk size and the index rather
+than by the size of the input.
+"""
+import os
+import numpy as np
+from .index import CatalogIndex
+from .match import match_coordinates
+
+__all__ = ['CatalogFile', 'iter_crossmatch', 'stream_crossmatch']
+
+
+class CatalogFile(object):
+    """
+    Chunked and random row access to a FITS, CSV, or npy catalog.
+
+    FITS binary tables and npy structured arrays are memory-mapped,
+    so reading a chunk or a set of rows only touches those rows. CSV
+    files are read sequentially in chunks; random row access (needed
+    for the reference catalog) reads the whole file once.
+
+    Parameters
+    ----------
+    path : string
+        Catalog file name (.fits, .fit, .csv, or .npy).
+    hdu : int, optional
+        FITS extension with the table.
+    """
+
+    def __init__(self, path, hdu=1):
+        self.path = path
+        self.hdu = hdu
+        ext = path.lower().split('.')[-1]
+        if ext in ['fits', 'fit', 'fz']:
+            self.format = 'fits'
+        elif ext in ['csv', 'npy']:
+            self.format = ext
+        else:
+            raise ValueError('unknown catalog format: '+path)
+        self._data = None
+
+    @property
+    def data(self):
+        """Memory-mapped table (or fully read CSV table)."""
+        if self._data is None:
+            if self.format=='fits':
+                from astropy.io import fits
+                self._data = fits.open(self.path, memmap=True)[self.hdu].data
+            elif self.format=='npy':
+                self._data = np.load(self.path, mmap_mode='r')
+            else:
+                from astropy.table import Table
+                self._data = Table.read(self.path, format='ascii.csv')
+        return self._data
+
+    def __len__(self):
+        return len(self.data)
+
+    def chunks(self, chunk_size, columns=None):
+        """
+        Iterate over the catalog in astropy Tables of chunk_size rows.
+        """
+        from astropy.table import Table
+        if self.format=='csv' and self._data is None:
+            import pandas as pd
+            for df in pd.read_csv(self.path, chunksize=chunk_size, usecols=columns):
+                yield Table.from_pandas(df)
+            return
+        for lo in range(0, len(self), chunk_size):
+            yield self._table(self.data[lo:lo+chunk_size], columns)
+
+    def rows(self, idx, columns=None):
+        """
+        Read the rows idx as an astropy Table.
+        """
+        return self._table(self.data[idx], columns)
+
+    def _table(self, data, columns):
+        from astropy.table import Table
+        if isinstance(data, Table):
+            return data if columns is None else data[columns]
+        if columns is None:
+            return Table(np.array(data))
+        return Table([np.array(data[col]) for col in columns], names=columns)
+
+    def radec(self, ra_colname='ra', dec_colname='dec', chunk_size=10**6):
+        """
+        Read only the ra and dec columns as float64 arrays.
+        """
+        ra, dec = [], []
+        for chunk in self.chunks(chunk_size, [ra_colname, dec_colname]):
+            ra.append(np.asarray(chunk[ra_colname], dtype=np.float64))
+            dec.append(np.asarray(chunk[dec_colname], dtype=np.float64))
+        return np.concatenate(ra), np.concatenate(dec)
+
+
+def iter_crossmatch(match_file, ref_file, maxsep, sep_units='arcsec',
+                    ra_colname='ra', dec_colname='dec', chunk_size=10**6,
+                    index=None, mode='nearest', columns_1=None, columns_2=None,
+                    n_jobs=1):
+    """
+    Crossmatch a (large) catalog file against a reference catalog file
+    chunk by chunk, yielding the matched rows of each chunk.
+
+    Parameters
+    ----------
+    match_file : string or CatalogFile
+        Catalog that is read in chunks (FITS, CSV, or npy).
+    ref_file : string or CatalogFile
+        Reference catalog. Only its matched rows are read.
+    maxsep : float
+        The maximum angular separation for which objects are
+        considered to be the same.
+    sep_units : string, optional, default = 'arcsec'
+        Units of maxsep. (arcsec, degree, or radian)
+    ra_colname : string, optional
+        The ra column name (same in both catalogs).
+    dec_colname : string, optional
+        The dec column name (same in both catalogs).
+    chunk_size : int, optional
+        Number of rows of match_file per chunk.
+    index : CatalogIndex or string, optional
+        Index of the reference catalog, or the path of a saved one. If
+        None, it is built from the coordinate columns of ref_file.
+    mode : string, optional, default = 'nearest'
+        Matching mode ('nearest', 'one-to-one', or 'all'); see
+        match_coordinates. One-to-one conflicts are only resolved
+        within a chunk.
+    columns_1, columns_2 : list, optional
+        Columns to read from match_file and ref_file. Default is all.
+    n_jobs : int, optional, default = 1
+        Number of processes used to match each chunk.
+
+    Yields
+    ------
+    matched_1 : astropy Table
+        Matched rows of match_file in this chunk.
+    matched_2 : astropy Table
+        Corresponding rows of ref_file.
+    sep2d : ndarray
+        The angular separations between the matches in units
+        given by sep_units.
+    """
+    if not isinstance(match_file, CatalogFile):
+        match_file = CatalogFile(match_file)
+    if not isinstance(ref_file, CatalogFile):
+        ref_file = CatalogFile(ref_file)
+    if index is None:
+        index = CatalogIndex(*ref_file.radec(ra_colname, dec_colname, chunk_size))
+    elif not isinstance(index, CatalogIndex):
+        index = CatalogIndex.load(index)
+    if columns_1 is not None:
+        columns_1 = list(columns_1) + [col for col in [ra_colname, dec_colname] 
+                                       if col not in columns_1]
+    for chunk in match_file.chunks(chunk_size, columns_1):
+        coords = (chunk[ra_colname], chunk[dec_colname])
+        if mode=='all':
+            offsets, idx, sep2d = match_coordinates(
+                coords, index, maxsep, sep_units, mode=mode, n_jobs=n_jobs)
+            mask = np.repeat(np.arange(len(chunk)), np.diff(offsets))
+        else:
+            mask, idx, sep2d = match_coordinates(
+                coords, index, maxsep, sep_units, True, mode=mode, n_jobs=n_jobs)
+        if len(idx) > 0:
+            # sorted reads are much kinder to memory-mapped files
+            order = np.argsort(idx, kind='stable')
+            ref_rows = ref_file.rows(idx[order], columns_2)
+            matched_2 = ref_rows[np.argsort(order)]
+        else:
+            matched_2 = ref_file.rows(np.zeros(0, dtype=int), columns_2)
+        yield chunk[mask], matched_2, sep2d
+
+
+def stream_crossmatch(match_file, ref_file, outfile, maxsep, sep_units='arcsec',
+                      overwrite=False, **kwargs):
+    """
+    Crossmatch catalog files with iter_crossmatch and write the matches
+    to outfile batch by batch. Each output row has the columns of both
+    catalogs (with suffixes _1 and _2 where names clash) and a sep column.
+
+    Parameters
+    ----------
+    match_file : string or CatalogFile
+        Catalog that is read in chunks (FITS, CSV, or npy).
+    ref_file : string or CatalogFile
+        Reference catalog.
+    outfile : string
+        Output file. A CSV file is appended to after each batch. For
+        FITS output, each batch is appended as a new binary table
+        extension.
+    maxsep : float
+        The maximum angular separation for which objects are
+        considered to be the same.
+    sep_units : string, optional, default = 'arcsec'
+        Units of maxsep and of the sep column.
+    overwrite : bool, optional
+        If True, overwrite outfile if it exists.
+    **kwargs :
+        Passed to iter_crossmatch.
+
+    Returns
+    -------
+    nmatch : int
+        Number of matched rows written.
+    """
+    from astropy.table import hstack
+    if os.path.exists(outfile):
+        assert overwrite, outfile+' exists'
+        os.remove(outfile)
+    fmt = 'csv' if outfile.lower().endswith('.csv') else 'fits'
+    nmatch = 0
+    first = True
+    for matched_1, matched_2, sep2d in iter_crossmatch(
+            match_file, ref_file, maxsep, sep_units, **kwargs):
+        if len(sep2d)==0 and not first:
+            continue
+        batch = hstack([matched_1, matched_2], table_names=['1', '2'])
+        batch['sep'] = sep2d
+        if fmt=='csv':
+            with open(outfile, 'a') as file:
+                batch.to_pandas().to_csv(file, header=first, index=False)
+        else:
+            from astropy.io import fits
+            fits.append(outfile, batch.as_array())
+        nmatch += len(batch)
+        first = False
+    return nmatch
@@ -0,0 +1,119 @@
+"""
+Multi-core matching with the zones engine. The matchcoord points are
+split into declination stripes, and each stripe is matched in its own
+process against the catalog rows within maxsep of the stripe. Every
+catalog point that can match a stripe is inside its margin, so the
+merged result is identical to the serial one. RA wrap-around is handled
+inside each stripe by the zone index, since stripes span all ra.
+"""
+import numpy as np
+from .zones import ZoneIndex
+from .index import CatalogIndex
+
+__all__ = ['striped_nearest', 'striped_pairs']
+
+# stripes per process, for load balancing
+STRIPES_PER_JOB = 4
+
+
+def _stripe_job(args):
+    """
+    Match one stripe. Runs in a worker process.
+    """
+    rows, ra, dec, catalog, maxsep, zone_height, what = args
+    if isinstance(catalog, str):
+        index, cat_rows = CatalogIndex.load(catalog), None
+    elif isinstance(catalog, CatalogIndex):
+        index, cat_rows = catalog, None
+    else:
+        cat_rows, cat_ra, cat_dec = catalog
+        index = ZoneIndex(cat_ra, cat_dec, zone_height)
+    if what=='nearest':
+        idx, sep = index.nearest(ra, dec, maxsep)
+        if cat_rows is not None:
+            idx[idx >= 0] = cat_rows[idx[idx >= 0]]
+        return rows, idx, sep
+    pairs = list(index.pairs(ra, dec, maxsep))
+    if not pairs:
+        return rows[:0], rows[:0], np.zeros(0)
+    i, j, d2 = [np.concatenate(p) for p in zip(*pairs)]
+    if cat_rows is not None:
+        j = cat_rows[j]
+    return rows[i], j, d2
+
+
+def _stripe_args(ra, dec, catalog, maxsep, zone_height, n_jobs, what):
+    """
+    Split the points into declination stripes with equal numbers of
+    points and select the catalog rows within maxsep of each stripe.
+    """
+    nstripes = max(1, min(STRIPES_PER_JOB*n_jobs, len(ra)))
+    order = np.argsort(dec, kind='stable')
+    for rows in np.array_split(order, nstripes):
+        if len(rows)==0:
+            continue
+        rows = np.sort(rows)
+        margin = maxsep*(1.0 + 1e-9)
+        lo, hi = dec[rows].min() - margin, dec[rows].max() + margin
+        if isinstance(catalog, CatalogIndex):
+            # workers memory-map a saved index rather than copying it;
+            # otherwise each gets only the zones its stripe can reach
+            unsaved = getattr(catalog, 'path', None) is None or\
+                      not all(catalog._saved)
+            cat = catalog._dec_slice(lo, hi) if unsaved else catalog.path
+        else:
+            cat_ra, cat_dec = catalog
+            cat_rows = np.flatnonzero((cat_dec >= lo) & (cat_dec <= hi))
+            cat = (cat_rows, cat_ra[cat_rows], cat_dec[cat_rows])
+        yield rows, ra[rows], dec[rows], cat, maxsep, zone_height, what
+
+
+def _run(ra, dec, catalog, maxsep, zone_height, n_jobs, what):
+    from concurrent.futures import ProcessPoolExecutor
+    jobs = _stripe_args(ra, dec, catalog, maxsep, zone_height, n_jobs, what)
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        for result in pool.map(_stripe_job, jobs):
+            yield result
+
+
+def striped_nearest(ra, dec, catalog, maxsep, zone_height, n_jobs):
+    """
+    Parallel version of ZoneIndex.nearest.
+
+    Parameters
+    ----------
+    ra, dec : ndarray
+        Query coordinates in degrees.
+    catalog : tuple or CatalogIndex
+        The (ra, dec) arrays of the catalog in degrees, or an index.
+    maxsep : float
+        Search radius in degrees.
+    zone_height : float
+        Zone height in degrees (ignored for a CatalogIndex).
+    n_jobs : int
+        Number of processes.
+
+    Returns
+    -------
+    idx : ndarray
+        Catalog index of the nearest point, or -1 if there is
+        no catalog point within maxsep.
+    sep : ndarray
+        Angular separation in degrees (inf where idx is -1).
+    """
+    idx = np.full(len(ra), -1, dtype=np.int64)
+    sep = np.full(len(ra), np.inf)
+    for rows, stripe_idx, stripe_sep in _run(
+            ra, dec, catalog, maxsep, zone_height, n_jobs, 'nearest'):
+        idx[rows] = stripe_idx
+        sep[rows] = stripe_sep
+    return idx, sep
+
+
+def striped_pairs(ra, dec, catalog, maxsep, zone_height, n_jobs):
+    """
+    Parallel version of ZoneIndex.pairs. Arguments are the same as
+    for striped_nearest. Yields (i, j, d2) for each stripe.
+    """
+    for result in _run(ra, dec, catalog, maxsep, zone_height, n_jobs, 'pairs'):
+        yield result
@@ -0,0 +1,231 @@
+"""
+Declination-zone spatial index for matching catalogs directly on
+float64 ra/dec arrays.
+
+The sky is cut into declination zones of fixed height and the catalog
+is sorted by (zone, ra). The neighbours of a point are found with
+binary searches in the zones that overlap its search circle, so only
+candidates in neighbouring cells are ever compared and no N x M
+structure is built.
+
+Reference: Gray et al. 2006, "The Zones Algorithm for Finding Points-Near-
+a-Point or Cross-Matching Spatial Datasets" (arXiv:cs/0701171).
+"""
+import numpy as np
+
+__all__ = ['ZoneIndex', 'radec_to_xyz']
+
+# queries are processed in chunks of this many points
+DEFAULT_CHUNK_SIZE = 2**18
+
+# smallest zone height in degrees (0.1 arcsec)
+MIN_ZONE_HEIGHT = 0.1/3600.0
+
+
+def radec_to_xyz(ra, dec):
+    """
+    Unit vectors for points on the sphere.
+
+    Parameters
+    ----------
+    ra, dec : ndarray
+        Coordinates in degrees.
+
+    Returns
+    -------
+    xyz : ndarray, shape (N, 3)
+        Unit vectors.
+    """
+    ra = np.deg2rad(np.asarray(ra, dtype=np.float64))
+    dec = np.deg2rad(np.asarray(dec, dtype=np.float64))
+    xyz = np.empty(ra.shape+(3,))
+    cos_dec = np.cos(dec)
+    xyz[..., 0] = cos_dec*np.cos(ra)
+    xyz[..., 1] = cos_dec*np.sin(ra)
+    xyz[..., 2] = np.sin(dec)
+    return xyz
+
+
+def chord_to_deg(d2):
+    """
+    Convert squared chord lengths between unit vectors to
+    angular separations in degrees.
+    """
+    return np.rad2deg(2.0*np.arcsin(np.minimum(np.sqrt(d2)/2.0, 1.0)))
+
+
+def _ra_half_width(dec, r):
+    """
+    Half-width in ra (degrees) of a circle of radius r (degrees)
+    centered at dec. Circles that touch a pole span all ra.
+    """
+    alpha = np.full(np.shape(dec), 180.0)
+    ok = np.abs(dec) + r < 89.999
+    if np.any(ok):
+        d, rr = np.deg2rad(dec[ok]), np.deg2rad(r)
+        denom = np.sqrt(np.abs(np.cos(d - rr)*np.cos(d + rr)))
+        alpha[ok] = np.rad2deg(np.arctan(np.sin(rr)/denom))
+        # pad for roundoff; candidates are checked exactly afterwards
+        alpha[ok] = np.minimum(alpha[ok]*(1.0 + 1e-8) + 1e-9, 180.0)
+    return alpha
+
+
+class ZoneIndex(object):
+    """
+    Catalog sorted into declination zones for fast neighbour searches.
+
+    Parameters
+    ----------
+    ra : ndarray
+        Right ascensions in degrees.
+    dec : ndarray
+        Declinations in degrees.
+    zone_height : float
+        Height of the declination zones in degrees. Searches are
+        fastest when this is close to the search radius.
+
+    Notes
+    -----
+    Indices returned by the query methods refer to the order of the
+    input arrays.
+    """
+
+    def __init__(self, ra, dec, zone_height):
+        ra = np.asarray(ra, dtype=np.float64).ravel() % 360.0
+        ra[ra >= 360.0] = 0.0
+        dec = np.asarray(dec, dtype=np.float64).ravel()
+        # keep zone*360 + ra well resolved in float64
+        self.zone_height = max(float(zone_height), MIN_ZONE_HEIGHT)
+        self.size = len(ra)
+        keys = self._zone(dec)*360.0 + ra
+        self.order = np.argsort(keys, kind='stable')
+        self.keys = keys[self.order]
+        self.xyz = radec_to_xyz(ra[self.order], dec[self.order])
+
+    @classmethod
+    def from_arrays(cls, keys, order, xyz, zone_height):
+        """
+        Rebuild an index from its sorted arrays (e.g., memory-mapped
+        arrays written by CatalogIndex.save).
+        """
+        index = cls.__new__(cls)
+        index.zone_height = zone_height
+        index.size = len(keys)
+        index.keys, index.order, index.xyz = keys, order, xyz
+        return index
+
+    def _zone(self, dec):
+        zone = np.floor((np.asarray(dec) + 90.0)/self.zone_height)
+        return np.maximum(zone, 0.0)
+
+    def _ranges(self, ra, dec, maxsep):
+        """
+        Slices of the sorted catalog that may hold points within maxsep
+        of each query point. Returns the query index and [start, stop)
+        of every slice.
+        """
+        n = len(ra)
+        zlo = self._zone(np.maximum(dec - maxsep, -90.0)).astype(np.int64)
+        zhi = self._zone(np.minimum(dec + maxsep, 90.0)).astype(np.int64)
+        nzones = zhi - zlo + 1
+        q = np.repeat(np.arange(n), nzones)
+        first = np.repeat(np.cumsum(nzones) - nzones, nzones)
+        zone = (zlo[q] + np.arange(len(q)) - first)*360.0
+
+        alpha = _ra_half_width(dec, maxsep)[q]
+        lo, hi = ra[q] - alpha, ra[q] + alpha
+        full = alpha >= 180.0
+        lo[full], hi[full] = 0.0, 360.0
+
+        # ra wrap-around at 0/360 adds a second interval
+        wlo, whi = lo < 0.0, hi > 360.0
+        q = np.concatenate([q, q[wlo], q[whi]])
+        klo = np.concatenate([zone + np.maximum(lo, 0.0),
+                              zone[wlo] + lo[wlo] + 360.0,
+                              zone[whi]])
+        khi = np.concatenate([zone + np.minimum(hi, 360.0),
+                              zone[wlo] + 360.0,
+                              zone[whi] + hi[whi] - 360.0])
+
+        # widen by the float resolution of the keys
+        eps = 4.0*np.spacing(self._zone(90.0)*360.0 + 360.0)
+        start = np.searchsorted(self.keys, klo - eps, side='left')
+        stop = np.searchsorted(self.keys, khi + eps, side='right')
+        return q, start, np.maximum(stop, start)
+
+    def pairs(self, ra, dec, maxsep, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Find all pairs of query points and catalog points within
+        maxsep of each other.
+
+        Parameters
+        ----------
+        ra, dec : ndarray
+            Query coordinates in degrees.
+        maxsep : float
+            Search radius in degrees.
+        chunk_size : int, optional
+            Number of query points processed at a time. This bounds
+            the memory used for candidate pairs.
+
+        Yields
+        ------
+        i : ndarray
+            Indices of the query points.
+        j : ndarray
+            Indices of the catalog points.
+        d2 : ndarray
+            Squared chord lengths between the unit vectors; use
+            chord_to_deg to convert to angular separations.
+        """
+        ra = np.asarray(ra, dtype=np.float64).ravel() % 360.0
+        dec = np.asarray(dec, dtype=np.float64).ravel()
+        chord2 = (2.0*np.sin(np.deg2rad(maxsep)/2.0))**2
+        # visiting queries in key order keeps the binary searches local
+        qorder = np.argsort(self._zone(dec)*360.0 + ra)
+        for lo in range(0, len(ra), chunk_size):
+            chunk = qorder[lo:lo + chunk_size]
+            q, start, stop = self._ranges(ra[chunk], dec[chunk], maxsep)
+            counts = stop - start
+            i = np.repeat(q, counts)
+            shift = np.repeat(np.cumsum(counts) - counts - start, counts)
+            jpos = np.arange(len(i)) - shift
+            d = radec_to_xyz(ra[chunk], dec[chunk])[i] - self.xyz[jpos]
+            d2 = np.einsum('ij,ij->i', d, d)
+            keep = d2 <= chord2*(1.0 + 1e-12)
+            yield chunk[i[keep]], self.order[jpos[keep]], d2[keep]
+
+    def nearest(self, ra, dec, maxsep, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Nearest catalog point to each query point, if it lies
+        within maxsep. Ties are broken by the smaller catalog index.
+
+        Parameters
+        ----------
+        ra, dec : ndarray
+            Query coordinates in degrees.
+        maxsep : float
+            Search radius in degrees.
+        chunk_size : int, optional
+            Number of query points processed at a time.
+
+        Returns
+        -------
+        idx : ndarray
+            Catalog index of the nearest point, or -1 if there is
+            no catalog point within maxsep.
+        sep : ndarray
+            Angular separation in degrees (inf where idx is -1).
+        """
+        n = np.size(ra)
+        best = np.full(n, np.inf)
+        idx = np.full(n, np.iinfo(np.int64).max)
+        for i, j, d2 in self.pairs(ra, dec, maxsep, chunk_size):
+            np.minimum.at(best, i, d2)
+            tie = d2 == best[i]
+            np.minimum.at(idx, i[tie], j[tie])
+        found = np.isfinite(best)
+        idx[~found] = -1
+        sep = np.full(n, np.inf)
+        sep[found] = chord_to_deg(best[found])
+        return idx, sep
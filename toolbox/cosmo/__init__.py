@@ -1 +1,4 @@
 from .cosmo import Cosmology
+from .cache import CosmologyCache, configure_cache
+from .neighbors import *
+from .lumfunc import *
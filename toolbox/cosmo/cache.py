@@ -0,0 +1,165 @@
+"""
+Memory-bounded cache shared by Cosmology instances. Instances with the
+same parameters share their distance tables, so creating many Cosmology
+objects with the same parameters does not rebuild them. Optionally, the
+results of recent array queries are shared too.
+
+Tables can also be written to a directory, so that new processes load
+them instead of rebuilding them. The directory of the default cache is
+set with configure_cache or the TOOLBOX_COSMO_CACHE environment
+variable.
+"""
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+__all__ = ['CosmologyCache', 'configure_cache']
+
+
+def digest(arr):
+    """
+    Hash of the contents, shape, and dtype of an array.
+    """
+    arr = np.ascontiguousarray(arr)
+    h = hashlib.blake2b(arr.view(np.uint8).ravel(), digest_size=16)
+    h.update(repr((arr.shape, arr.dtype.str)).encode())
+    return h.hexdigest()
+
+
+class CosmologyCache(object):
+    """
+    Least-recently-used cache of arrays with a cap on their total size.
+
+    Each entry is a tuple of arrays. Entries added with put_table are
+    also written to path (if given) and read back from there when they
+    are not in memory.
+
+    Parameters
+    ----------
+    max_bytes : int, optional
+        Maximum total size of the cached arrays. The least recently
+        used entries are evicted beyond this.
+    path : string, optional
+        Directory for persistent tables.
+    memoize : bool, optional
+        If True, also keep the results of E, rhocrit, and com_dist 
+        for array inputs, keyed by a hash of the input. Hashing costs 
+        about as much as E itself, so this only pays off when the 
+        same arrays are queried repeatedly.
+    """
+
+    def __init__(self, max_bytes=2**28, path=None, memoize=False):
+        self.max_bytes = max_bytes
+        self.path = path
+        self.memoize = memoize
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __reduce__(self):
+        # worker processes get an empty cache with the same settings
+        return (self.__class__, (self.max_bytes, self.path, self.memoize))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        """
+        Cached arrays for key, or None.
+        """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        """
+        Cache the tuple of arrays value under key.
+        """
+        value = tuple(np.asarray(arr) for arr in value)
+        size = sum(arr.nbytes for arr in value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= sum(arr.nbytes for arr in self._entries.pop(key))
+            self._entries[key] = value
+            self.nbytes += size
+            self._evict()
+
+    def _evict(self):
+        while self.nbytes > self.max_bytes:
+            _, old = self._entries.popitem(last=False)
+            self.nbytes -= sum(arr.nbytes for arr in old)
+
+    def resize(self, max_bytes):
+        """
+        Change the memory cap, evicting entries if needed.
+        """
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        """
+        Empty the in-memory cache (files in path are kept).
+        """
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def _filename(self, key):
+        name = hashlib.blake2b(repr(key).encode(), digest_size=16).hexdigest()
+        return os.path.join(self.path, name+'.npz')
+
+    def get_table(self, key):
+        """
+        Cached table for key, from memory or from path, or None.
+        """
+        value = self.get(key)
+        if value is None and self.path is not None:
+            fn = self._filename(key)
+            if os.path.exists(fn):
+                with np.load(fn) as file:
+                    value = tuple(file['arr_{}'.format(num)]
+                                  for num in range(len(file.files)))
+                self.put(key, value)
+        return value
+
+    def put_table(self, key, value):
+        """
+        Cache a table and write it to path.
+        """
+        self.put(key, value)
+        if self.path is not None:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path, exist_ok=True)
+            fn = self._filename(key)
+            # write then rename, so concurrent readers never see
+            # a partial file
+            tmp = '{}.{}.tmp'.format(fn, os.getpid())
+            with open(tmp, 'wb') as file:
+                np.savez(file, *value)
+            os.replace(tmp, fn)
+
+
+default_cache = CosmologyCache(path=os.environ.get('TOOLBOX_COSMO_CACHE'))
+
+
+def configure_cache(max_bytes=None, path=None, memoize=None):
+    """
+    Change the memory cap, table directory, and/or memoize option 
+    of the cache shared by Cosmology instances by default.
+    """
+    if max_bytes is not None:
+        default_cache.resize(max_bytes)
+    if path is not None:
+        default_cache.path = path
+    if memoize is not None:
+        default_cache.memoize = memoize
@@ -1,45 +1,230 @@
 #!/usr/bin/env python 
 
+import functools
 import numpy as np
 from ..astro import angsep
 from ..utils import isiterable, vectorize_if_needed
 from scipy.integrate import quad
+from .cache import default_cache, digest
 WMAP9 = [0.693, 0.287, 1.0-0.287]
 
+# order of the gauss-legendre rule used on each interval of the 
+# comoving distance table
+GAUSS_ORDER = 8
+
+# below this redshift, the flat closed form suffers from cancellation
+# and the distance integral is evaluated with a gauss-legendre rule
+FLAT_ZMIN = 0.1
+
+# arrays of at least this many redshifts are interpolated from the table 
+# even for flat cosmologies, since hyp2f1 costs more than the spline
+FLAT_TABLE_MIN = 1024
+
+# full sky in square degrees
+FULL_SKY = 4.0*np.pi*(180.0/np.pi)**2
+
+# number of points in the tables used to invert distances
+INVERSE_TABLE_SIZE = 2**14
+
+
+def _cached(method):
+    """
+    Memoize a method of one array argument in the cache of the 
+    Cosmology instance, if the cache has memoize set. Scalars are 
+    not memoized, since hashing them costs more than the methods.
+    """
+    @functools.wraps(method)
+    def wrapper(self, z):
+        if self.cache is None or not self.cache.memoize or np.ndim(z)==0:
+            return method(self, z)
+        try:
+            arr = np.asarray(z, dtype=np.float64)
+        except (TypeError, ValueError):
+            return method(self, z)
+        key = self._key + (method.__name__, digest(arr))
+        hit = self.cache.get(key)
+        if hit is not None:
+            return hit[0].copy()
+        result = method(self, z)
+        self.cache.put(key, (np.array(result),))
+        return result
+    return wrapper
+
+
 class Cosmology:
     """
     Class for calculating common cosmological quantities
+
+    Comoving distances (and the quantities derived from them) are 
+    interpolated from a table of the distance integral in ln(1+z), 
+    which is built the first time it is needed. For flat cosmologies 
+    (Omega_M0 + Omega_L0 = 1), scalars and small arrays are instead 
+    evaluated in closed form, as are redshifts outside [0, zmax]; 
+    otherwise, those are integrated directly.
+
+    Parameters
+    ----------
+    params : list, optional
+        h, Omega_M0, and Omega_L0.
+    rtol : float, optional
+        Relative accuracy of the tabulated comoving distance.
+    zmax : float, optional
+        Maximum redshift of the table.
+    cache : CosmologyCache, optional
+        Cache for distance tables (and, if its memoize option is set, 
+        the results of E, rhocrit, and com_dist), shared by all 
+        instances with the same parameters. Default is the cache set 
+        up with configure_cache. If None, nothing is cached.
     """
-    def __init__(self, params=WMAP9):
+    def __init__(self, params=WMAP9, rtol=1e-8, zmax=10.0, cache=default_cache):
         self.h, self.omegaM0, self.omegaL0 = params
         self.H0 = 100.0*self.h # km/s/Mpc
         self.c = 2.99792458e5 # km/s
         self.G = 4.302113488372941e-09 # km2 Mpc / (M_sun s2)
         self.DH = self.c/self.H0
+        self.rtol = rtol
+        self.zmax = zmax
+        self._com_dist_table = None
+        self._inverse_tables = {}
+        self.cache = cache
+        self._key = (float(self.h), float(self.omegaM0), float(self.omegaL0), 
+                     float(rtol), float(zmax))
+        self.flat = (self.omegaM0 > 0) and (self.omegaL0 >= 0) and\
+                    abs(self.omegaM0 + self.omegaL0 - 1.0) < 1e-10
 
+    def _E(self, z):
+        if isiterable(z):
+            z = np.asarray(z)
+        return np.sqrt(self.omegaM0*(1.0+z)**3 + self.omegaL0)
+
+    @_cached
     def E(self, z):
         """
         the ratio of the Hubble parameter at redshift z to
         its present value
         """
-        if isiterable(z):
-            z = np.asarray(z)
-        return np.sqrt(self.omegaM0*(1.0+z)**3 + self.omegaL0)
+        return self._E(z)
 
+    @_cached
     def rhocrit(self, z):
         """
         critical density in units of Msun Mpc^-3
         """
         if isiterable(z):
             z = np.asarray(z)
-        return (3.0*(self.H0*self.E(z))**2)/(8*np.pi*self.G) 
+        return (3.0*(self.H0*self._E(z))**2)/(8*np.pi*self.G) 
+
+    def _dchi_dx(self, x):
+        """
+        derivative of the comoving distance (in units of DH) 
+        with respect to x = ln(1+z)
+        """
+        opz = np.exp(x)
+        return opz/self._E(opz - 1.0)
+
+    def _cumulative_chi(self, x):
+        """
+        comoving distance in units of DH at the sorted values 
+        x = ln(1+z), starting from x[0] = 0
+        """
+        nodes, weights = np.polynomial.legendre.leggauss(GAUSS_ORDER)
+        half = 0.5*np.diff(x)
+        mid = 0.5*(x[1:] + x[:-1])
+        f = self._dchi_dx(mid[:, None] + half[:, None]*nodes)
+        return np.concatenate([[0.0], np.cumsum(half*f.dot(weights))])
+
+    @property
+    def com_dist_table(self):
+        """
+        cubic hermite spline of the comoving distance in units of 
+        DH as a function of ln(1+z) for 0 <= z <= zmax. The grid is 
+        refined until the spline matches the integral to rtol at the 
+        midpoints of its intervals.
+        """
+        if self._com_dist_table is None:
+            from scipy.interpolate import CubicHermiteSpline
+            key = self._key + ('com_dist_table',)
+            table = None if self.cache is None else self.cache.get_table(key)
+            if table is not None:
+                self._com_dist_table = CubicHermiteSpline(*table)
+                return self._com_dist_table
+            xmax = np.log1p(self.zmax)
+            num = 16
+            while True:
+                x = np.linspace(0.0, xmax, num + 1)
+                both = self._cumulative_chi(np.linspace(0.0, xmax, 2*num + 1))
+                chi, chi_mid = both[::2], both[1::2]
+                spline = CubicHermiteSpline(x, chi, self._dchi_dx(x))
+                err = np.abs(spline(0.5*(x[1:] + x[:-1])) - chi_mid)
+                if np.all(err <= self.rtol*chi_mid) or num >= 2**20:
+                    break
+                num *= 4
+            if self.cache is not None:
+                self.cache.put_table(key, (x, chi, self._dchi_dx(x)))
+            self._com_dist_table = spline
+        return self._com_dist_table
+
+    def com_dist_exact(self, z):
+        """
+        comoving distance as a function of z, integrated 
+        numerically for each z 
+        """
+        func = lambda z: quad(lambda z : 1.0/self._E(z), 0, z)[0]
+        return self.DH*vectorize_if_needed(func, z)
+
+    def _flat_chi(self, z):
+        """
+        comoving distance in units of DH for a flat cosmology. 
+
+        With u = 1 + z and s = Omega_L0/Omega_M0,
+
+            int du/sqrt(Omega_M0 u^3 + Omega_L0) = -G(u) + const,
+            G(u) = 2/sqrt(Omega_M0 u) 2F1(1/6, 1/2; 7/6; -s/u^3)
+                 = 2/sqrt(Omega_M0 u (1 + s/u^3)) 
+                   2F1(1, 1/2; 7/6; s/(s + u^3)),
+
+        using the Pfaff transformation so that the argument of the
+        hypergeometric function is in [0, 1). 
+        """
+        from scipy.special import hyp2f1
+        s = self.omegaL0/self.omegaM0
+        def G(u):
+            u3 = u**3
+            return 2.0/np.sqrt(self.omegaM0*u*(1.0 + s/u3))*\
+                   hyp2f1(1.0, 0.5, 7.0/6.0, s/(s + u3))
+        chi = np.array(G(1.0) - G(1.0 + z))
+        small = np.abs(z) < FLAT_ZMIN
+        if np.any(small):
+            zs = z[small]
+            nodes, weights = np.polynomial.legendre.leggauss(GAUSS_ORDER)
+            f = 1.0/self._E(0.5*zs[..., None]*(nodes + 1.0))
+            chi[small] = 0.5*zs*f.dot(weights)
+        return chi
 
+    @_cached
     def com_dist(self, z):
         """
         comoving distance as a function of z
         """
-        func = lambda z: quad(lambda z : 1.0/self.E(z), 0, z)[0]
-        return self.DH*vectorize_if_needed(func, z)
+        return self._com_dist(z)
+
+    def _com_dist(self, z):
+        z = np.asarray(z, dtype=np.float64)
+        if self.flat and z.size < FLAT_TABLE_MIN:
+            chi = self.DH*self._flat_chi(z)
+            return chi if chi.ndim else float(chi)
+        inside = (z >= 0.0) & (z <= self.zmax)
+        if np.all(inside):
+            chi = self.com_dist_table(np.log1p(z))
+        else:
+            chi = np.empty(z.shape)
+            chi[inside] = self.com_dist_table(np.log1p(z[inside]))
+            if self.flat:
+                chi[~inside] = self._flat_chi(z[~inside])
+            else:
+                chi[~inside] = self.com_dist_exact(z[~inside])/self.DH
+        chi = self.DH*chi
+        return chi if chi.ndim else float(chi)
 
     def D_L(self, z):
         """
@@ -57,6 +242,156 @@ class Cosmology:
             z = np.asarray(z)
         return self.com_dist(z) / (1.0 + z)
 
+    def _dist_and_deriv(self, kind, z):
+        """
+        distance of the given kind and its derivative with 
+        respect to z
+        """
+        chi = self._com_dist(z)
+        dchi = self.DH/self._E(z)
+        if kind=='com_dist':
+            return chi, dchi
+        elif kind=='D_L':
+            return chi*(1.0 + z), chi + (1.0 + z)*dchi
+        else:
+            return chi/(1.0 + z), (dchi - chi/(1.0 + z))/(1.0 + z)
+
+    def _inverse_table(self, kind):
+        """
+        monotonically increasing table of distances of the given 
+        kind and ln(1+z) for 0 <= z <= zmax. For D_A, the table 
+        stops at the maximum of D_A.
+        """
+        if kind not in self._inverse_tables:
+            key = self._key + ('inverse_table', kind, INVERSE_TABLE_SIZE)
+            table = None if self.cache is None else self.cache.get_table(key)
+            if table is None:
+                x = np.linspace(0.0, np.log1p(self.zmax), INVERSE_TABLE_SIZE)
+                dist = self._dist_and_deriv(kind, np.expm1(x))[0]
+                if kind=='D_A':
+                    peak = np.argmax(dist) + 1
+                    x, dist = x[:peak], dist[:peak]
+                table = (dist, x)
+                if self.cache is not None:
+                    self.cache.put_table(key, table)
+            self._inverse_tables[kind] = table
+        return self._inverse_tables[kind]
+
+    def _z_at_dist(self, kind, dist, tol, maxiter):
+        """
+        invert the distance of the given kind; see z_at_com_dist
+        """
+        dist = np.asarray(dist, dtype=np.float64)
+        table_dist, table_x = self._inverse_table(kind)
+        z = np.expm1(np.interp(dist, table_dist, table_x, 
+                               left=np.nan, right=np.nan))
+        if tol is not None:
+            zmax = np.expm1(table_x[-1])
+            z = np.atleast_1d(z)
+            todo = np.flatnonzero(np.isfinite(z))
+            target = np.atleast_1d(dist)
+            for _ in range(maxiter):
+                if len(todo)==0:
+                    break
+                f, df = self._dist_and_deriv(kind, z[todo])
+                step = (f - target[todo])/df
+                z[todo] = np.clip(z[todo] - step, 0.0, zmax)
+                todo = todo[np.abs(step) > tol*(1.0 + z[todo])]
+            z = z.reshape(dist.shape)
+        return z if z.ndim else float(z)
+
+    def z_at_com_dist(self, dist, tol=None, maxiter=10):
+        """
+        redshift at which the comoving distance (in Mpc) is dist
+
+        Parameters
+        ----------
+        dist : float or ndarray
+            Comoving distance(s) in Mpc.
+        tol : float, optional
+            If given, refine the redshifts with Newton iterations 
+            until the step is below tol*(1+z). Otherwise, they are 
+            interpolated linearly from a table in ln(1+z), with a 
+            relative error of ~1e-8 in 1+z.
+        maxiter : int, optional
+            Maximum number of Newton iterations.
+
+        Returns
+        -------
+        z : float or ndarray
+            Redshift(s); nan if dist is outside the range 
+            covered by 0 <= z <= zmax.
+        """
+        return self._z_at_dist('com_dist', dist, tol, maxiter)
+
+    def z_at_D_L(self, dist, tol=None, maxiter=10):
+        """
+        redshift at which the luminosity distance (in Mpc) is dist. 
+        See z_at_com_dist for the parameters.
+        """
+        return self._z_at_dist('D_L', dist, tol, maxiter)
+
+    def z_at_D_A(self, dist, tol=None, maxiter=10):
+        """
+        redshift at which the angular diameter distance (in Mpc) is 
+        dist. D_A has a maximum, so this returns the lower of the two
+        redshifts (and nan above the maximum). The table is less 
+        accurate close to the maximum, where D_A is flat, so use tol 
+        there. See z_at_com_dist for the parameters.
+        """
+        return self._z_at_dist('D_A', dist, tol, maxiter)
+
+    def dist_mod(self, z):
+        """
+        distance modulus as a function of z
+        """
+        return 5.0*np.log10(self.D_L(z)) + 25.0
+
+    def com_volume(self, z, z_min=0.0, area=None):
+        """
+        comoving volume in Mpc^3 between z_min and z
+
+        Parameters
+        ----------
+        z : float or ndarray
+            Upper redshift(s).
+        z_min : float or ndarray, optional
+            Lower redshift(s).
+        area : float, optional
+            Survey area in square degrees. Default is the full sky.
+
+        Returns
+        -------
+        V : float or ndarray
+            Comoving volume(s) in Mpc^3.
+        """
+        fsky = 1.0 if area is None else area/FULL_SKY
+        V = (4.0*np.pi/3.0)*fsky*(np.asarray(self.com_dist(z))**3 - 
+                                  np.asarray(self.com_dist(z_min))**3)
+        return V if np.ndim(V) else float(V)
+
+    def z_at_dist_mod(self, mu, tol=None, maxiter=10):
+        """
+        redshift at which the distance modulus is mu. See 
+        z_at_com_dist for the parameters.
+        """
+        D_L = 10.0**(0.2*(np.asarray(mu, dtype=np.float64) - 25.0))
+        return self.z_at_D_L(D_L, tol, maxiter)
+
+    def com_xyz(self, ra, dec, z):
+        """
+        comoving cartesian coordinates (in Mpc) of galaxies, as 
+        an array of shape (N, 3)
+        """
+        ra = np.deg2rad(np.asarray(ra, dtype=np.float64))
+        dec = np.deg2rad(np.asarray(dec, dtype=np.float64))
+        Dc = np.asarray(self.com_dist(z))
+        xyz = np.empty(np.shape(Dc)+(3,))
+        xyz[..., 0] = Dc*np.cos(dec)*np.cos(ra)
+        xyz[..., 1] = Dc*np.cos(dec)*np.sin(ra)
+        xyz[..., 2] = Dc*np.sin(dec)
+        return xyz
+
     def com_sep(self, coord3d_1, coord3d_2):
         """
         comoving separation between two galaxies 
@@ -0,0 +1,84 @@
+"""
+Volume weights for luminosity and stellar mass functions.
+"""
+import numpy as np
+from .cosmo import Cosmology
+
+__all__ = ['zmax_from_mag', 'inverse_vmax']
+
+
+def zmax_from_mag(abs_mag, mag_lim, cosmo=None, tol=None):
+    """
+    Redshift at which galaxies with absolute magnitude abs_mag reach 
+    the apparent magnitude limit mag_lim, found for all galaxies at 
+    once by inverting the tabulated distance modulus.
+
+    Parameters
+    ----------
+    abs_mag : ndarray
+        Absolute magnitudes (including any k-correction).
+    mag_lim : float or ndarray
+        Apparent magnitude limit(s).
+    cosmo : Cosmology, optional
+        Default is Cosmology().
+    tol : float, optional
+        Tolerance in z passed to Cosmology.z_at_dist_mod. 
+        If None, the table is interpolated without refinement.
+
+    Returns
+    -------
+    z : ndarray
+        The limiting redshifts; inf beyond the cosmology's zmax.
+    """
+    if cosmo is None:
+        cosmo = Cosmology()
+    mu = np.asarray(mag_lim, dtype=np.float64) - np.asarray(abs_mag, dtype=np.float64)
+    z = np.atleast_1d(cosmo.z_at_dist_mod(mu, tol)).reshape(mu.shape)
+    z = np.where(np.isnan(z) & (mu > 0), np.inf, z)
+    return z if z.ndim else float(z)
+
+
+def inverse_vmax(abs_mag, mag_lim, z_range, area=None, bright_lim=None, 
+                 cosmo=None, tol=None):
+    """
+    1/Vmax weights of a magnitude-limited sample.
+
+    Parameters
+    ----------
+    abs_mag : ndarray
+        Absolute magnitudes (including any k-correction).
+    mag_lim : float or ndarray
+        Faint apparent magnitude limit(s).
+    z_range : tuple
+        Redshift range (z_min, z_max) of the sample.
+    area : float, optional
+        Survey area in square degrees. Default is the full sky.
+    bright_lim : float or ndarray, optional
+        Bright apparent magnitude limit(s), if any. 
+    cosmo : Cosmology, optional
+        Default is Cosmology().
+    tol : float, optional
+        Tolerance in z of the limiting redshifts.
+
+    Returns
+    -------
+    weights : ndarray
+        1/Vmax in Mpc^-3; zero for galaxies that could not 
+        be observed anywhere in z_range.
+    z_lims : tuple of ndarrays
+        The lower and upper limits of the redshift range over 
+        which each galaxy would be in the sample.
+    """
+    if cosmo is None:
+        cosmo = Cosmology()
+    z_min, z_max = z_range
+    z_hi = np.minimum(zmax_from_mag(abs_mag, mag_lim, cosmo, tol), z_max)
+    if bright_lim is None:
+        z_lo = np.full(np.shape(z_hi), float(z_min))
+    else:
+        z_lo = np.maximum(zmax_from_mag(abs_mag, bright_lim, cosmo, tol), z_min)
+    z_lo = np.minimum(z_lo, z_hi)
+    vmax = np.asarray(cosmo.com_volume(z_hi, z_lo, area))
+    weights = np.zeros(vmax.shape)
+    np.divide(1.0, vmax, out=weights, where=vmax > 0)
+    return weights, (z_lo, z_hi)
@@ -0,0 +1,220 @@
+"""
+Neighbour searches in comoving space. Galaxy coordinates (ra, dec, z)
+are converted once to comoving cartesian coordinates, and the searches
+are done with a KD-tree, so no N x N structure is ever built.
+
+Large samples are split into slabs along the x axis that are searched
+separately, optionally in parallel processes, much like the declination 
+stripes of toolbox.cats.
+"""
+import numpy as np
+from .cosmo import Cosmology
+
+__all__ = ['com_pairs', 'com_knn']
+
+# galaxies per slab for the pair search
+DEFAULT_CHUNK_SIZE = 2**18
+
+
+def _xyz(ra, dec, z, cosmo):
+    if cosmo is None:
+        cosmo = Cosmology()
+    return cosmo.com_xyz(ra, dec, z).reshape(-1, 3)
+
+
+def _slab_job(args):
+    """
+    All pairs in one slab. A pair belongs to the slab that holds the 
+    point with the smaller x. Runs in a worker process when n_jobs > 1.
+    """
+    from scipy.spatial import cKDTree
+    rows, xyz, ncore, radius, pi_max = args
+    r = radius if pi_max is None else np.hypot(radius, pi_max)
+    pairs = cKDTree(xyz).query_pairs(r, output_type='ndarray')
+    pairs = pairs[(pairs[:, 0] < ncore) | (pairs[:, 1] < ncore)]
+    xyz_1, xyz_2 = xyz[pairs[:, 0]], xyz[pairs[:, 1]]
+    if pi_max is None:
+        sep = np.sqrt(np.sum((xyz_2 - xyz_1)**2, axis=1))
+    else:
+        sep, pi = _projected(xyz_1, xyz_2)
+        keep = (sep <= radius) & (pi <= pi_max)
+        pairs, sep = pairs[keep], sep[keep]
+    i, j = rows[pairs[:, 0]], rows[pairs[:, 1]]
+    return np.minimum(i, j), np.maximum(i, j), sep
+
+
+def _slab_args(xyz, radius, pi_max, chunk_size):
+    """
+    Split the points into slabs in x with equal numbers of points. 
+    Each slab holds its own points first, followed by the points 
+    within r of its upper edge.
+    """
+    r = radius if pi_max is None else np.hypot(radius, pi_max)
+    order = np.argsort(xyz[:, 0], kind='stable')
+    x = xyz[order, 0]
+    nslabs = max(1, int(np.ceil(len(x)/float(chunk_size))))
+    edges = np.linspace(0, len(x), nslabs + 1).astype(int)
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        if hi==lo:
+            continue
+        stop = np.searchsorted(x, x[hi - 1] + r*(1.0 + 1e-9), side='right')
+        rows = order[lo:stop]
+        yield rows, xyz[rows], hi - lo, radius, pi_max
+
+
+def _iter_slabs(xyz, radius, pi_max, chunk_size, n_jobs):
+    jobs = _slab_args(xyz, radius, pi_max, chunk_size)
+    if n_jobs==1:
+        for result in map(_slab_job, jobs):
+            yield result
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            for result in pool.map(_slab_job, jobs):
+                yield result
+
+
+def _projected(xyz_1, xyz_2):
+    """
+    Projected (perpendicular) and line-of-sight separations of pairs,
+    with the line of sight along the mean of the two positions.
+    """
+    diff = xyz_2 - xyz_1
+    los = xyz_1 + xyz_2
+    los /= np.sqrt(np.sum(los**2, axis=1))[:, None]
+    pi = np.abs(np.sum(diff*los, axis=1))
+    rp2 = np.maximum(np.sum(diff**2, axis=1) - pi**2, 0.0)
+    return np.sqrt(rp2), pi
+
+
+def com_pairs(ra, dec, z, radius, pi_max=None, cosmo=None, n_jobs=1,
+              chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Find all pairs of galaxies within a comoving radius of each other.
+
+    Parameters
+    ----------
+    ra, dec : ndarray
+        Coordinates in degrees.
+    z : ndarray
+        Redshifts.
+    radius : float
+        Comoving radius in Mpc. If pi_max is given, this is the 
+        maximum projected separation.
+    pi_max : float, optional
+        If given, select pairs by projected separation r_p <= radius
+        and line-of-sight separation pi <= pi_max (in comoving Mpc)
+        rather than by 3D separation.
+    cosmo : Cosmology, optional
+        Cosmology for the comoving distances. Default is Cosmology().
+    n_jobs : int, optional, default = 1
+        Number of processes.
+    chunk_size : int, optional
+        Number of galaxies per slab. This bounds the memory used 
+        by each search.
+
+    Returns
+    -------
+    i, j : ndarray
+        Indices of the pairs, with i < j. Each pair is listed once, 
+        and the pairs are sorted by i and then j.
+    sep : ndarray
+        Comoving separations (or projected separations if pi_max 
+        is given) in Mpc.
+
+    Examples
+    --------
+    >>> i, j, sep = com_pairs([], [], [], 5.0)
+    >>> len(i), i.dtype, j.dtype, sep.dtype
+    (0, dtype('int64'), dtype('int64'), dtype('float64'))
+    >>> idx, sep = com_knn([], [], [], 3, radius=5.0, pi_max=20.0)
+    >>> idx.shape, sep.shape
+    ((0, 3), (0, 3))
+    """
+    xyz = _xyz(ra, dec, z, cosmo)
+    results = list(_iter_slabs(xyz, radius, pi_max, chunk_size, n_jobs))
+    if not results:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0)
+    i, j, sep = [np.concatenate(res) for res in zip(*results)]
+    order = np.lexsort((j, i))
+    return i[order], j[order], sep[order]
+
+
+def com_knn(ra, dec, z, k, radius=np.inf, pi_max=None, cosmo=None, n_jobs=1,
+            chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Find the k nearest neighbours of each galaxy in comoving space.
+
+    Parameters
+    ----------
+    ra, dec : ndarray
+        Coordinates in degrees.
+    z : ndarray
+        Redshifts.
+    k : int
+        Number of neighbours.
+    radius : float, optional
+        Only return neighbours within this comoving radius in Mpc 
+        (or projected radius if pi_max is given). Must be finite
+        if pi_max is given.
+    pi_max : float, optional
+        If given, rank neighbours by projected separation among those
+        with line-of-sight separation pi <= pi_max (in comoving Mpc).
+    cosmo : Cosmology, optional
+        Cosmology for the comoving distances. Default is Cosmology().
+    n_jobs : int, optional, default = 1
+        Number of threads (or processes if pi_max is given).
+    chunk_size : int, optional
+        Number of galaxies searched at a time.
+
+    Returns
+    -------
+    idx : ndarray, shape (N, k)
+        Indices of the neighbours, nearest first; -1 where a galaxy 
+        has fewer than k neighbours within radius.
+    sep : ndarray, shape (N, k)
+        Comoving (or projected) separations in Mpc; inf where 
+        idx is -1.
+    """
+    if pi_max is not None:
+        assert np.isfinite(radius), 'radius must be finite if pi_max is given'
+        i, j, sep = com_pairs(ra, dec, z, radius, pi_max, cosmo, n_jobs, chunk_size)
+        n = np.size(ra)
+        return _rank_pairs(np.concatenate([i, j]), np.concatenate([j, i]), 
+                           np.concatenate([sep, sep]), n, k)
+    from scipy.spatial import cKDTree
+    xyz = _xyz(ra, dec, z, cosmo)
+    n = len(xyz)
+    tree = cKDTree(xyz)
+    idx = np.full((n, k), -1, dtype=np.int64)
+    sep = np.full((n, k), np.inf)
+    for lo in range(0, n, chunk_size):
+        rows = np.arange(lo, min(lo + chunk_size, n))
+        dist, nbr = tree.query(xyz[rows], k + 1, distance_upper_bound=radius,
+                               workers=n_jobs)
+        # drop each galaxy itself, or the farthest candidate if 
+        # exact duplicates pushed it out of the list
+        is_self = nbr==rows[:, None]
+        is_self[~is_self.any(axis=1), -1] = True
+        nbr = nbr[~is_self].reshape(len(rows), k)
+        dist = dist[~is_self].reshape(len(rows), k)
+        found = nbr < n
+        idx[rows] = np.where(found, nbr, -1)
+        sep[rows] = np.where(found, dist, np.inf)
+    return idx, sep
+
+
+def _rank_pairs(i, j, sep, n, k):
+    """
+    The k closest j of each i, from a list of pairs.
+    """
+    order = np.lexsort((j, sep, i))
+    i, j, sep = i[order], j[order], sep[order]
+    first = np.searchsorted(i, np.arange(n))
+    rank = np.arange(len(i)) - first[i]
+    keep = rank < k
+    idx = np.full((n, k), -1, dtype=np.int64)
+    out = np.full((n, k), np.inf)
+    idx[i[keep], rank[keep]] = j[keep]
+    out[i[keep], rank[keep]] = sep[keep]
+    return idx, out
@@ -1,2 +1,3 @@
 from .img_scale import *
-from .zscale import zscale
+from .zscale import zscale, zscale_sample, zscale_stack
+from .background import *
@@ -0,0 +1,209 @@
+"""
+Spatially varying sky background. The image is cut into boxes, a
+sigma-clipped sky and rms are measured in each box, the resulting mesh
+is median filtered to suppress boxes affected by large sources, and the
+mesh is interpolated back to the full image.
+
+Each box is read from the image only when it is processed, so
+memory-mapped images (e.g., FITS files opened with memmap=True) are
+never read in full, and only a few boxes are in memory at a time.
+"""
+import warnings
+import numpy as np
+from .img_scale import _sig_clip
+
+__all__ = ['background_mesh', 'interpolate_mesh', 'background_2d']
+
+
+def _box_edges(size, box_size):
+    edges = np.arange(0, size, box_size)
+    return np.append(edges, size)
+
+
+def _box_stats(args):
+    """
+    Clipped sky and rms of one box. Runs in a worker thread.
+    """
+    img, ys, xs, use_median, sig_fract, percent_fract, max_iter, \
+        min_fraction, sample = args
+    box = np.asarray(img[ys, xs])
+    nfinite = np.count_nonzero(np.isfinite(box)) if box.dtype.kind=='f' else box.size
+    if nfinite < min_fraction*box.size or nfinite==0:
+        return np.nan, np.nan
+    sky, _, rms = _sig_clip(box, use_median, sig_fract, percent_fract,
+                            max_iter, True, True, sample, return_rms=True)
+    if not np.isfinite(sky):
+        # every pixel was clipped, e.g., in a constant box
+        sky, rms = np.nanmedian(box), np.nanstd(box)
+    return sky, rms
+
+
+def background_mesh(img, box_size=64, sig_fract=3.0, percent_fract=0.01,
+                    max_iter=10, estimator='median', min_fraction=0.5,
+                    sample=None, n_jobs=1):
+    """
+    Sigma-clipped sky and rms in boxes across an image.
+
+    Parameters
+    ----------
+    img : 2D ndarray
+        Image, which may be memory-mapped.
+    box_size : int or tuple, optional
+        Box size in pixels (or (ny, nx)). Boxes at the upper edges
+        of the image may be smaller.
+    sig_fract : float, optional
+        Clipping threshold in units of sigma.
+    percent_fract : float, optional
+        Convergence fraction of the clipping (see sky_median_sig_clip).
+    max_iter : int, optional
+        Maximum number of clipping iterations.
+    estimator : string, optional
+        'median' or 'mean' of the clipped pixels.
+    min_fraction : float, optional
+        Boxes with a smaller fraction of finite pixels are
+        set to nan.
+    sample : int, optional
+        If given, clip a subsample of about this many pixels,
+        on a regular grid, in each box.
+    n_jobs : int, optional, default = 1
+        Number of threads.
+
+    Returns
+    -------
+    sky : 2D ndarray
+        Sky of each box.
+    rms : 2D ndarray
+        Standard deviation of the clipped pixels of each box.
+    """
+    assert estimator in ['median', 'mean'], 'estimator must be median or mean'
+    ny_box, nx_box = np.broadcast_to(box_size, (2,))
+    y_edges = _box_edges(img.shape[0], ny_box)
+    x_edges = _box_edges(img.shape[1], nx_box)
+    jobs = ((img, slice(y0, y1), slice(x0, x1), estimator=='median', sig_fract,
+             percent_fract, max_iter, min_fraction, sample)
+            for y0, y1 in zip(y_edges[:-1], y_edges[1:])
+            for x0, x1 in zip(x_edges[:-1], x_edges[1:]))
+    if n_jobs==1:
+        results = list(map(_box_stats, jobs))
+    else:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+            results = list(pool.map(_box_stats, jobs))
+    shape = (len(y_edges) - 1, len(x_edges) - 1)
+    sky, rms = [np.array(res).reshape(shape) for res in zip(*results)]
+    return sky, rms
+
+
+def _fill_nan(mesh):
+    """
+    Replace nan boxes with the median of their finite neighbours,
+    repeating until the mesh is filled.
+    """
+    mesh = mesh.copy()
+    if np.all(np.isnan(mesh)):
+        return mesh
+    while np.isnan(mesh).any():
+        padded = np.pad(mesh, 1, constant_values=np.nan)
+        neighbours = np.stack([padded[1 + dy:padded.shape[0] - 1 + dy,
+                                      1 + dx:padded.shape[1] - 1 + dx]
+                               for dy in (-1, 0, 1) for dx in (-1, 0, 1)])
+        bad = np.isnan(mesh) & np.isfinite(neighbours).any(axis=0)
+        with warnings.catch_warnings():
+            # all-nan neighbourhoods are filled in a later pass
+            warnings.simplefilter('ignore', RuntimeWarning)
+            mesh[bad] = np.nanmedian(neighbours[:, bad], axis=0)
+    return mesh
+
+
+def _interp_weights(size, edges):
+    """
+    Lower mesh index and weight of the upper one for linear
+    interpolation between box centers at each pixel.
+    """
+    centers = 0.5*(edges[:-1] + edges[1:] - 1)
+    t = np.interp(np.arange(size), centers, np.arange(len(centers)))
+    i0 = np.minimum(t.astype(int), max(len(centers) - 2, 0))
+    return i0, t - i0
+
+
+def interpolate_mesh(mesh, shape, box_size, out=None, chunk_rows=1024):
+    """
+    Bilinear interpolation of a mesh of box values (at the box centers)
+    to the full image. Beyond the outermost box centers the values are
+    constant.
+
+    Parameters
+    ----------
+    mesh : 2D ndarray
+        Box values, e.g., from background_mesh.
+    shape : tuple
+        Shape of the image.
+    box_size : int or tuple
+        Box size used for the mesh.
+    out : 2D ndarray, optional
+        Output array (e.g., a memory-mapped file).
+    chunk_rows : int, optional
+        Number of image rows interpolated at a time.
+
+    Returns
+    -------
+    out : 2D ndarray
+        Interpolated image.
+    """
+    ny_box, nx_box = np.broadcast_to(box_size, (2,))
+    if out is None:
+        out = np.empty(shape)
+    iy, wy = _interp_weights(shape[0], _box_edges(shape[0], ny_box))
+    ix, wx = _interp_weights(shape[1], _box_edges(shape[1], nx_box))
+    # pad so that the upper neighbour exists for single-box meshes
+    mesh = np.pad(mesh, ((0, 1), (0, 1)), mode='edge')
+    for lo in range(0, shape[0], chunk_rows):
+        rows = slice(lo, min(lo + chunk_rows, shape[0]))
+        w = wy[rows, None]
+        mesh_rows = mesh[iy[rows]]*(1.0 - w) + mesh[iy[rows] + 1]*w
+        block = mesh_rows[:, ix]
+        block *= 1.0 - wx
+        block += mesh_rows[:, ix + 1]*wx
+        out[rows] = block
+    return out
+
+
+def background_2d(img, box_size=64, filter_size=3, return_rms=False,
+                  out=None, **kwargs):
+    """
+    Smooth background (and rms) map of an image.
+
+    Parameters
+    ----------
+    img : 2D ndarray
+        Image, which may be memory-mapped.
+    box_size : int or tuple, optional
+        Box size in pixels (or (ny, nx)).
+    filter_size : int or tuple, optional
+        Size of the median filter applied to the mesh, in boxes.
+        Use 1 for no filtering.
+    return_rms : bool, optional
+        If True, also return the rms map.
+    out : 2D ndarray, optional
+        Output array for the background map.
+    **kwargs :
+        Passed to background_mesh (e.g., sig_fract, n_jobs).
+
+    Returns
+    -------
+    bkg : 2D ndarray
+        Background map.
+    rms : 2D ndarray
+        Background rms map (if return_rms is True).
+    """
+    from scipy.ndimage import median_filter
+
+    def smooth(mesh, out=None):
+        mesh = _fill_nan(mesh)
+        if np.max(filter_size) > 1:
+            mesh = median_filter(mesh, size=filter_size, mode='nearest')
+        return interpolate_mesh(mesh, img.shape, box_size, out=out)
+
+    sky, rms = background_mesh(img, box_size, **kwargs)
+    bkg = smooth(sky, out)
+    return (bkg, smooth(rms)) if return_rms else bkg
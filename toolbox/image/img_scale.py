@@ -20,15 +20,99 @@ from __future__ import print_function
 
 import numpy
 import math
+from .zscale import zscale_sample
 
 __all__ = ['sky_median_sig_clip', 'sky_mean_sig_clip', 'range_from_zscale',
            'range_from_percentile', 'histeq', 'linear', 'sqrt', 'log', 'asinh', 'power']
 
-def sky_median_sig_clip(input_arr, sig_fract, percent_fract, max_iter=100, low_cut=True, high_cut=True):
+# pixels per block when compacting the survivors of a clip
+COMPACT_BLOCK = 2**16
+
+def _sig_clip(input_arr, use_median, sig_fract, percent_fract, max_iter,
+              low_cut, high_cut, sample, return_rms=False):
+    """Sigma clipping engine of sky_median_sig_clip and sky_mean_sig_clip.
+
+    The surviving pixels are compacted in place after each clip, the 
+    masks are written into preallocated buffers, medians are found with an 
+    in-place partition (selection rather than a full sort), and the 
+    mean and standard deviation come from two reductions without 
+    temporaries. Non-finite pixels are dropped at the start. With
+    return_rms, the standard deviation of the surviving pixels is 
+    returned as a third value.
+
+    """
+    if sample is not None and numpy.size(input_arr) > sample:
+        # a regular grid, so that the stride cannot line up with rows
+        flat = zscale_sample(input_arr, sample)
+    else:
+        flat = numpy.ravel(input_arr)
+    dtype = flat.dtype if flat.dtype.kind=='f' else numpy.float64
+    finite = numpy.isfinite(flat)
+    if finite.all():
+        # partition reorders the pixels, so always work on a copy
+        work = numpy.array(flat, dtype=dtype)
+    else:
+        work = flat[finite].astype(dtype, copy=False)
+    mask = numpy.empty(len(work), dtype=bool)
+    scratch = numpy.empty(len(work), dtype=bool)
+
+    def center(arr):
+        if len(arr)==0:
+            return numpy.float64(numpy.nan)
+        if not use_median:
+            return numpy.add.reduce(arr, dtype=numpy.float64)/len(arr)
+        k = len(arr)//2
+        if len(arr) % 2:
+            arr.partition(k)
+            return numpy.float64(arr[k])
+        arr.partition([k-1, k])
+        return 0.5*(numpy.float64(arr[k-1]) + numpy.float64(arr[k]))
+
+    def std(arr):
+        if len(arr)==0:
+            return numpy.nan
+        mean = numpy.add.reduce(arr, dtype=numpy.float64)/len(arr)
+        sumsq = numpy.einsum('i,i->', arr, arr, dtype=numpy.float64)
+        return math.sqrt(max(sumsq/len(arr) - mean*mean, 0.0))
+
+    def clip(work, sky):
+        n = len(work)
+        sig = std(work)
+        if high_cut or not low_cut:
+            numpy.less(work, sky + sig_fract * sig, out=mask[:n])
+        else:
+            mask[:n] = True
+        if low_cut:
+            numpy.greater(work, sky - sig_fract * sig, out=scratch[:n])
+            mask[:n] &= scratch[:n]
+        # move the survivors to the front of the buffer, one block at
+        # a time; a block is read before anything is written over it
+        k = 0
+        for lo in range(0, n, COMPACT_BLOCK):
+            hi = min(lo + COMPACT_BLOCK, n)
+            kept = work[lo:hi][mask[lo:hi]]
+            work[k:k+len(kept)] = kept
+            k += len(kept)
+        return work[:k]
+
+    old_sky = center(work)
+    work = clip(work, old_sky)
+    new_sky = center(work)
+    iteration = 0
+    while ((math.fabs(old_sky - new_sky)/new_sky) > percent_fract) and (iteration < max_iter) :
+        iteration += 1
+        old_sky = new_sky
+        work = clip(work, old_sky)
+        new_sky = center(work)
+    if return_rms:
+        return (new_sky, iteration, std(work))
+    return (new_sky, iteration)
+
+def sky_median_sig_clip(input_arr, sig_fract, percent_fract, max_iter=100, low_cut=True, high_cut=True, sample=None):
     """Estimating a sky value for a given number of iterations
 
     @type input_arr: numpy array
-    @param input_arr: image data array
+    @param input_arr: image data array (NaNs are ignored)
     @type sig_fract: float
     @param sig_fract: fraction of sigma clipping
     @type percent_fract: float
@@ -39,47 +123,22 @@ def sky_median_sig_clip(input_arr, sig_fract, percent_fract, max_iter=100, low_c
     @param low_cut: cut out only low values
     @type high_cut: boolean
     @param high_cut: cut out only high values
+    @type sample: integer
+    @param sample: if given, use about this many pixels on a regular
+        grid. The sky then has a statistical error of about 
+        1.25*sigma/sqrt(sample) (e.g., 0.4% of sigma for 10^5 pixels).
     @rtype: tuple
     @return: (sky value, number of iterations)
 
     """
-    work_arr = numpy.ravel(input_arr)
-    old_sky = numpy.median(work_arr)
-    sig = work_arr.std()
-    upper_limit = old_sky + sig_fract * sig
-    lower_limit = old_sky - sig_fract * sig
-    if low_cut and high_cut:
-        indices = numpy.where((work_arr < upper_limit) & (work_arr > lower_limit))
-    else:
-        if low_cut:
-            indices = numpy.where((work_arr > lower_limit))
-        else:
-            indices = numpy.where((work_arr < upper_limit))
-    work_arr = work_arr[indices]
-    new_sky = numpy.median(work_arr)
-    iteration = 0
-    while ((math.fabs(old_sky - new_sky)/new_sky) > percent_fract) and (iteration < max_iter) :
-        iteration += 1
-        old_sky = new_sky
-        sig = work_arr.std()
-        upper_limit = old_sky + sig_fract * sig
-        lower_limit = old_sky - sig_fract * sig
-        if low_cut and high_cut:
-            indices = numpy.where((work_arr < upper_limit) & (work_arr > lower_limit))
-        else:
-            if low_cut:
-                indices = numpy.where((work_arr > lower_limit))
-            else:
-                indices = numpy.where((work_arr < upper_limit))
-        work_arr = work_arr[indices]
-        new_sky = numpy.median(work_arr)
-    return (new_sky, iteration)
+    return _sig_clip(input_arr, True, sig_fract, percent_fract, max_iter,
+                     low_cut, high_cut, sample)
 
-def sky_mean_sig_clip(input_arr, sig_fract, percent_fract, max_iter=100, low_cut=True, high_cut=True):
+def sky_mean_sig_clip(input_arr, sig_fract, percent_fract, max_iter=100, low_cut=True, high_cut=True, sample=None):
     """Estimating a sky value for a given number of iterations
 
     @type input_arr: numpy array
-    @param input_arr: image data array
+    @param input_arr: image data array (NaNs are ignored)
     @type sig_fract: float
     @param sig_fract: fraction of sigma clipping
     @type percent_fract: float
@@ -90,41 +149,16 @@ def sky_mean_sig_clip(input_arr, sig_fract, percent_fract, max_iter=100, low_cut
     @param low_cut: cut out only low values
     @type high_cut: boolean
     @param high_cut: cut out only high values
+    @type sample: integer
+    @param sample: if given, use about this many pixels on a regular
+        grid. The sky then has a statistical error of about 
+        sigma/sqrt(sample) (e.g., 0.3% of sigma for 10^5 pixels).
     @rtype: tuple
     @return: (sky value, number of iterations)
 
     """
-    work_arr = numpy.ravel(input_arr)
-    old_sky = numpy.mean(work_arr)
-    sig = work_arr.std()
-    upper_limit = old_sky + sig_fract * sig
-    lower_limit = old_sky - sig_fract * sig
-    if low_cut and high_cut:
-        indices = numpy.where((work_arr < upper_limit) & (work_arr > lower_limit))
-    else:
-        if low_cut:
-            indices = numpy.where((work_arr > lower_limit))
-        else:
-            indices = numpy.where((work_arr < upper_limit))
-    work_arr = work_arr[indices]
-    new_sky = numpy.mean(work_arr)
-    iteration = 0
-    while ((math.fabs(old_sky - new_sky)/new_sky) > percent_fract) and (iteration < max_iter) :
-        iteration += 1
-        old_sky = new_sky
-        sig = work_arr.std()
-        upper_limit = old_sky + sig_fract * sig
-        lower_limit = old_sky - sig_fract * sig
-        if low_cut and high_cut:
-            indices = numpy.where((work_arr < upper_limit) & (work_arr > lower_limit))
-        else:
-            if low_cut:
-                indices = numpy.where((work_arr > lower_limit))
-            else:
-                indices = numpy.where((work_arr < upper_limit))
-        work_arr = work_arr[indices]
-        new_sky = numpy.mean(work_arr)
-    return (new_sky, iteration)
+    return _sig_clip(input_arr, False, sig_fract, percent_fract, max_iter,
+                     low_cut, high_cut, sample)
 
 def range_from_zscale(input_arr, contrast = 1.0, sig_fract = 3.0, percent_fract = 0.01, max_iter=100, low_cut=True, high_cut=True):
     """Estimating ranges with the zscale algorithm
@@ -231,68 +265,77 @@ def range_from_percentile(input_arr, low_cut=0.25, high_cut=0.25):
 
     return (z1, z2)
 
-def histeq(inputArray, num_bins=1024):
+def histeq(inputArray, num_bins=1024, sample_step=1):
     """Performs histogram equalisation of the input numpy array.
+
+    The cumulative histogram is built with a single bincount and the
+    pixels are mapped through a num_bins lookup table, so the cost is
+    a few passes over the image. Non-finite pixels are ignored and 
+    become NaN.
     
     @type inputArray: numpy array
-    @param inputArray: image data array
+    @param inputArray: image data array (float or integer)
     @type num_bins: int
     @param num_bins: number of bins in which to perform the operation (e.g. 1024)
+    @type sample_step: int
+    @param sample_step: build the histogram from every sample_step-th pixel
     @rtype: numpy array
-    @return: image data array
+    @return: image data array (float32 for float32 input, else float64)
     
     """     
     
-    imageData=numpy.array(inputArray, copy=True)
-    
-    # histogram equalisation: we want an equal number of pixels in each intensity range
-    sortedDataIntensities=numpy.sort(numpy.ravel(imageData))    
-    median=numpy.median(sortedDataIntensities)
-    
-    # Make cumulative histogram of data values, simple min-max used to set bin sizes and range
-    dataCumHist=numpy.zeros(num_bins)
-    minIntensity=sortedDataIntensities.min()    
-    maxIntensity=sortedDataIntensities.max()
-    histRange=maxIntensity-minIntensity
-    binWidth=histRange/float(num_bins-1)
-    for i in range(len(sortedDataIntensities)):
-        binNumber=int(math.ceil((sortedDataIntensities[i]-minIntensity)/binWidth))
-        addArray=numpy.zeros(num_bins)
-        onesArray=numpy.ones(num_bins-binNumber)
-        onesRange=range(binNumber, num_bins)
-        numpy.put(addArray, onesRange, onesArray)
-        dataCumHist=dataCumHist+addArray
-                
-    # Make ideal cumulative histogram
-    idealValue=dataCumHist.max()/float(num_bins)
-    idealCumHist=numpy.arange(idealValue, dataCumHist.max()+idealValue, idealValue)
+    imageData = numpy.asarray(inputArray)
+    dtype = numpy.float32 if imageData.dtype==numpy.float32 else numpy.float64
+    flat = imageData.ravel()
+    finite = numpy.isfinite(flat) if flat.dtype.kind=='f' else None
+    if finite is not None and finite.all():
+        finite = None
+    sample = flat[::sample_step]
+    if finite is not None:
+        sample = sample[finite[::sample_step]]
+    if len(sample)==0:
+        return numpy.full(imageData.shape, numpy.nan, dtype=dtype)
+
+    # Simple min-max used to set bin sizes and range
+    valid = flat if finite is None else flat[finite]
+    minIntensity = float(valid.min())
+    maxIntensity = float(valid.max())
+    histRange = maxIntensity - minIntensity
+    if histRange==0:
+        return numpy.where(numpy.isnan(imageData), numpy.nan, 0.0).astype(dtype)
+    binWidth = histRange/float(num_bins-1)
+
+    def intensity_bins(values):
+        bins = numpy.subtract(values, minIntensity, dtype=numpy.float64)
+        bins *= 1.0/binWidth
+        numpy.ceil(bins, out=bins)
+        # Guard against rounding errors (happens rarely I think)
+        numpy.clip(bins, 0, num_bins-1, out=bins)
+        return bins.astype(numpy.intp)
+
+    # Cumulative histogram of data values
+    dataCumHist = numpy.cumsum(numpy.bincount(intensity_bins(sample), minlength=num_bins))
     
+    # Ideal cumulative histogram, and the intensity it assigns to each bin
+    idealValue = dataCumHist[-1]/float(num_bins)
+    idealCumHist = idealValue*numpy.arange(1, num_bins+1)
+    idealBin = numpy.searchsorted(idealCumHist, dataCumHist)
+    lut = (idealBin*binWidth + minIntensity).astype(dtype)
+
     # Map the data to the ideal
-    for y in range(imageData.shape[0]):
-        for x in range(imageData.shape[1]):
-        # Get index corresponding to dataIntensity
-            intensityBin=int(math.ceil((imageData[y][x]-minIntensity)/binWidth))
-            
-    # Guard against rounding errors (happens rarely I think)
-    if intensityBin<0:
-        intensityBin=0
-    if intensityBin>len(dataCumHist)-1:
-        intensityBin=len(dataCumHist)-1
-        
-    # Get the cumulative frequency corresponding intensity level in the data
-    dataCumFreq=dataCumHist[intensityBin]
-            
-    # Get the index of the corresponding ideal cumulative frequency
-    idealBin=numpy.searchsorted(idealCumHist, dataCumFreq)
-    idealIntensity=(idealBin*binWidth)+minIntensity
-    imageData[y][x]=idealIntensity
-
-    scale_min = imageData.min()
-    scale_max = imageData.max()
-    imageData.clip(min=scale_min, max=scale_max, out=imageData)
-    imageData = (imageData -scale_min) / (scale_max - scale_min)
-    indices = numpy.where(imageData < 0)
-    imageData[indices] = 0.0
+    if finite is None:
+        imageData = lut[intensity_bins(flat)]
+    else:
+        imageData = numpy.full(flat.shape, numpy.nan, dtype=dtype)
+        imageData[finite] = lut[intensity_bins(valid)]
+    imageData = imageData.reshape(numpy.shape(inputArray))
+
+    scale_min = numpy.nanmin(imageData)
+    scale_max = numpy.nanmax(imageData)
+    if scale_max==scale_min:
+        return numpy.where(numpy.isnan(imageData), numpy.nan, 0.0).astype(dtype)
+    imageData -= scale_min
+    imageData *= 1.0/(scale_max - scale_min)
         
     return imageData
 
@@ -1,5 +1,32 @@
 import numpy as np
 
+
+def zscale_sample(img, samples=1000):
+    """
+    Sample pixels of img on a regular grid, like IRAF does. Only 
+    the grid is read, so this is cheap for large and memory-mapped
+    images, and the samples are the same on every call.
+
+    Parameters
+    ----------
+    img : ndarray
+        Image (or any array) to sample.
+    samples : int, optional
+        Maximum number of samples.
+
+    Returns
+    -------
+    sample : 1D ndarray
+        The finite pixel values on the grid.
+    """
+    img = np.asanyarray(img)
+    step = max(1, int((img.size/float(samples))**(1.0/max(img.ndim, 1))))
+    sample = np.array(img[(slice(None, None, step),)*img.ndim]).ravel()
+    if len(sample) > samples:
+        sample = sample[np.linspace(0, len(sample) - 1, samples).astype(int)]
+    return sample[np.isfinite(sample)]
+
+
 def zscale(img, contrast=0.25, samples=1000):
     """
     Implement IRAF zscale algorithm; samples=1000 
@@ -12,7 +39,8 @@ def zscale(img, contrast=0.25, samples=1000):
     contrast : float, optional
         Desired contrast
     samples : int, optional
-        Number of samples to take from img
+        Number of samples to take from img. They are taken 
+        on a regular grid (see zscale_sample).
 
     Returns 
     -------
@@ -25,11 +53,7 @@ def zscale(img, contrast=0.25, samples=1000):
     ------ 
     http://hsca.ipmu.jp/hscsphinx/scripts/psfMosaic.html
     """
-    ravel = img.ravel()[~np.isnan(img.ravel())]
-    if len(ravel) > samples:
-        imsort = np.sort(np.random.choice(ravel, size=samples))
-    else:
-        imsort = np.sort(ravel)
+    imsort = np.sort(zscale_sample(img, samples))
 
     n = len(imsort)
     idx = np.arange(n)
@@ -44,3 +68,118 @@ def zscale(img, contrast=0.25, samples=1000):
     z2 = med + (slope/contrast)*(n/2-n*w)
 
     return z1, z2
+
+
+def _grow(bad, before, after):
+    """
+    Flag the pixels within [k - before, k + after] of a flagged pixel 
+    k, with per-row window sizes.
+    """
+    n = bad.shape[1]
+    grown = np.empty_like(bad)
+    for b, a in set(zip(before, after)):
+        rows = np.flatnonzero((before==b) & (after==a))
+        # running count of flagged pixels, padded so that a window 
+        # is the difference of two shifted slices
+        csum = np.zeros((len(rows), n + a + b + 1), dtype=np.int32)
+        np.cumsum(bad[rows], axis=1, out=csum[:, b + 1:b + n + 1])
+        csum[:, b + n + 1:] = csum[:, b + n:b + n + 1]
+        grown[rows] = csum[:, a + b + 1:] > csum[:, :n]
+    return grown
+
+
+def zscale_stack(images, contrast=0.25, samples=1000, max_reject=0.5,
+                 min_npixels=5, krej=2.5, max_iterations=5):
+    """
+    IRAF zscale, with its iterative rejection of deviant pixels, for a 
+    stack of images at once. Sorting, line fitting, and rejection are 
+    vectorized over the images.
+
+    Parameters
+    ----------
+    images : 3D ndarray or list of ndarrays
+        (N, H, W) image cube or list of images (of any sizes).
+    contrast : float, optional
+        Desired contrast
+    samples : int, optional
+        Number of samples to take from each image (see zscale_sample).
+    max_reject : float, optional
+        Maximum fraction of samples that may be rejected. 
+    min_npixels : int, optional
+        Minimum number of samples that must remain after rejection.
+    krej : float, optional
+        Rejection threshold in units of the residual standard deviation.
+    max_iterations : int, optional
+        Maximum number of fit and rejection iterations.
+
+    Returns
+    -------
+    z1 : ndarray
+        Min pixel values of the N images
+    z2 : ndarray
+        Max pixel values of the N images
+    """
+    if isinstance(images, np.ndarray) and images.ndim==3:
+        step = max(1, int(np.sqrt(images[0].size/float(samples))))
+        data = np.array(images[:, ::step, ::step], dtype=np.float64)
+        data = data.reshape(len(data), -1)
+        if data.shape[1] > samples:
+            data = data[:, np.linspace(0, data.shape[1] - 1, samples).astype(int)]
+        data[~np.isfinite(data)] = np.nan
+    else:
+        rows = [zscale_sample(img, samples) for img in images]
+        data = np.full((len(rows), max([len(r) for r in rows] + [1])), np.nan)
+        for num, row in enumerate(rows):
+            data[num, :len(row)] = row
+
+    # nans are sorted to the end of each row
+    data = np.sort(data, axis=1)
+    nimg, width = data.shape
+    npix = np.sum(np.isfinite(data), axis=1)
+    x = np.arange(width, dtype=np.float64)
+    row = np.arange(nimg)
+    zmin = data[:, 0]
+    zmax = data[row, np.maximum(npix - 1, 0)]
+
+    inside = x < npix[:, None]
+    good = inside.copy()
+    y = np.where(good, data, 0.0)
+    minpix = np.maximum(min_npixels, (npix*max_reject).astype(int))
+    ngrow = np.maximum(1, (npix*0.01).astype(int))
+    ngood = npix.copy()
+    last_ngood = npix + 1
+    slope = np.zeros(nimg)
+    for _ in range(max_iterations):
+        act = np.flatnonzero((ngood < last_ngood) & (ngood >= minpix))
+        if len(act)==0:
+            break
+        # weighted least-squares line through the good samples
+        g, ya = good[act], y[act]
+        w = g.astype(np.float64)
+        wy = w*ya
+        sw, sx, sy = w.sum(1), w.dot(x), wy.sum(1)
+        sxx, sxy = w.dot(x*x), wy.dot(x)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fit_slope = (sw*sxy - sx*sy)/(sw*sxx - sx*sx)
+            intercept = (sy - fit_slope*sx)/sw
+        slope[act] = fit_slope
+        flat = ya - intercept[:, None]
+        flat -= fit_slope[:, None]*x
+        resid = flat*w
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = resid.sum(1)/sw
+            std = np.sqrt(np.maximum((resid*resid).sum(1)/sw - mean*mean, 0.0))
+        bad = (np.abs(flat) > (krej*std)[:, None]) | ~g
+        bad &= inside[act]
+        g = ~_grow(bad, ngrow[act]//2, (ngrow[act] - 1)//2) & inside[act]
+        good[act] = g
+        last_ngood[act] = ngood[act]
+        ngood[act] = g.sum(1)
+
+    center = (npix - 1)//2
+    upper = np.minimum(npix//2, width - 1)
+    median = 0.5*(data[row, np.maximum(center, 0)] + data[row, upper])
+    slope = slope/contrast if contrast > 0 else slope
+    z1 = np.where(ngood >= minpix, np.maximum(zmin, median - (center - 1)*slope), zmin)
+    z2 = np.where(ngood >= minpix, np.minimum(zmax, median + (npix - center)*slope), zmax)
+    return z1, z2
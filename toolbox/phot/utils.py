@@ -25,22 +25,120 @@ mAB_0 = 48.6
 # FUV_mag = -2.5 * log10(flux) + 18.82
 galex_NUV_mAB_0 = 20.08
 galex_FUV_mAB_0 = 18.82    
+# L_nu/f_nu for an object at 10 pc, in cm^2
+AREA_10PC = 4*np.pi*(10*u.pc).to('cm')**2
+# Kennicutt (1998) SFR/L_nu in the UV, in (M_sun/yr)/(erg/s/Hz)
+SFR_UV_PER_LNU = 1.4e-28
 
 
 def sdss_to_V_jester_2005(g, g_r): 
     return g - 0.59*(g_r) - 0.01
 
 
-def absolute_magnitude(mag, z=None, D_L=None, cosmo=None):
-    if D_L is None:
-        assert z is not None, 'must give z or D_L'
-        z = _make_array_if_needed(z)
-        if cosmo is None:
-            from astropy.cosmology import FlatLambdaCDM
-            cosmo = FlatLambdaCDM(70.0, 0.3)
-        D_L = cosmo.luminosity_distance(z)
+# h, Omega_M0, and Omega_L0 of the default cosmology 
+DEFAULT_COSMO_PARAMS = [0.7, 0.3, 0.7]
+_default_cosmo = []
+
+
+def default_cosmology():
+    """
+    The Cosmology used when none is given, created once and reused.
+    """
+    if not _default_cosmo:
+        from ..cosmo import Cosmology
+        _default_cosmo.append(Cosmology(DEFAULT_COSMO_PARAMS))
+    return _default_cosmo[0]
+
+
+class DistModTable(object):
+    """
+    Distance modulus interpolated from a table, for repeated 
+    absolute magnitude calculations.
+
+    The table holds mu(z) - 5 log10(z), which is smooth down to z = 0,
+    on a uniform grid in ln(1+z). Linear interpolation on the default 
+    grid is accurate to ~1e-8 mag.
+
+    Parameters
+    ----------
+    cosmo : Cosmology, optional
+        Default is default_cosmology().
+    zmax : float, optional
+        Maximum redshift of the table. Redshifts beyond are 
+        computed with cosmo.
+    num : int, optional
+        Number of grid points.
+    """
+
+    def __init__(self, cosmo=None, zmax=10.0, num=2**14):
+        self.cosmo = default_cosmology() if cosmo is None else cosmo
+        self.zmax = zmax
+        self.x = np.linspace(0.0, np.log1p(zmax), num)
+        z = np.expm1(self.x[1:])
+        self.g = np.empty(num)
+        self.g[0] = 5.0*np.log10(self.cosmo.DH) + 25.0
+        self.g[1:] = self.cosmo.dist_mod(z) - 5.0*np.log10(z)
+
+    def __call__(self, z):
+        z = np.asarray(z, dtype=np.float64)
+        # the grid is uniform, so locate z without a binary search
+        t = np.log1p(z)
+        t *= (len(self.x) - 1)/self.x[-1]
+        i = np.clip(t.astype(np.intp), 0, len(self.x) - 2)
+        t -= i
+        mu = self.g[i]
+        mu += t*(self.g[i + 1] - mu)
+        mu += 5.0*np.log10(z)
+        outside = z > self.zmax
+        if np.any(outside):
+            mu = np.array(mu)
+            mu[outside] = self.cosmo.dist_mod(z[outside])
+        return mu
+
+
+def absolute_magnitude(mag, z=None, D_L=None, cosmo=None, dist_mod=None):
+    """
+    Absolute magnitude from apparent magnitude, using (in order of 
+    precedence) dist_mod, D_L, or the distance to z in cosmo. 
+
+    Parameters
+    ----------
+    mag : float or ndarray
+        Apparent magnitude(s).
+    z : float or ndarray, optional
+        Redshift(s).
+    D_L : float, ndarray, or Quantity, optional
+        Luminosity distance(s); in Mpc if not a Quantity.
+    cosmo : Cosmology or astropy cosmology, optional
+        Cosmology for the distances. Default is default_cosmology(),
+        a flat cosmology with H0 = 70 and Omega_M0 = 0.3 that is 
+        created once.
+    dist_mod : ndarray or callable, optional
+        Distance modulus, or a function that returns it for z, 
+        such as a DistModTable.
+
+    Returns
+    -------
+    abs_mag : float or ndarray
+        Absolute magnitude(s) as plain floats.
+    """
     mag = _make_array_if_needed(mag)
-    return mag - 5*np.log10(D_L.to('pc').value) + 5
+    if dist_mod is None and D_L is None:
+        assert z is not None, 'must give z, D_L, or dist_mod'
+        if cosmo is None:
+            cosmo = default_cosmology()
+        if hasattr(cosmo, 'dist_mod'):
+            dist_mod = cosmo.dist_mod
+        else:
+            D_L = cosmo.luminosity_distance(_make_array_if_needed(z))
+    if dist_mod is not None:
+        if callable(dist_mod):
+            assert z is not None, 'must give z with a dist_mod function'
+            dist_mod = dist_mod(_make_array_if_needed(z))
+        return mag - dist_mod
+    if hasattr(D_L, 'unit'):
+        D_L = D_L.to('Mpc').value
+    return mag - 5*np.log10(D_L) - 25
 
 
 def lum_solar_units(abs_mag, band):
@@ -60,8 +158,7 @@ def fnu_from_AB_mag(mag):
 
 def lnu_from_AB_mag(abs_mag):
     abs_mag = _make_array_if_needed(abs_mag)
-    d = 10*u.pc
-    return 4*np.pi*(d.to('cm'))**2*fnu_from_AB_mag(abs_mag)
+    return AREA_10PC*fnu_from_AB_mag(abs_mag)
 
 
 def sfr_uv(Lnu):
@@ -69,31 +166,222 @@ def sfr_uv(Lnu):
     Star formation rate in M_sun/yr from L_nu in UV. 
     Kennicutt, Jr., R. C. 1998, ARA&A, 36, 189
     """
-    return 1.4e-28*(Lnu/(u.erg/u.s/u.Hz)).decompose()*u.Msun/u.yr
+    return SFR_UV_PER_LNU*(Lnu/(u.erg/u.s/u.Hz)).decompose()*u.Msun/u.yr
+
+
+def _load_bell_table():
+    """
+    Read the Bell et al. (2003) coefficients into an array of shape 
+    (colors, bands, 2) holding a and b of log(M/L) = a + b*color.
+    """
+    fn = os.path.join(project_dir, 'data/bell-table.txt')
+    with open(fn) as file:
+        lines = [line.split() for line in file if line.strip()]
+    bands = [col[1:] for col in lines[0][1::2]]
+    colors = [line[0] for line in lines[1:]]
+    coeffs = np.array([line[1:] for line in lines[1:]], dtype=np.float64)
+    return colors, bands, coeffs.reshape(len(colors), len(bands), 2)
+
+BELL_COLORS, BELL_BANDS, BELL_COEFFS = _load_bell_table()
+# index into BELL_BANDS of each of BANDS (-1 if not in the table)
+BELL_BAND_INDEX = np.array([BELL_BANDS.index(b) if b in BELL_BANDS else -1 
+                            for b in BANDS])
+M_SUN_BANDS = np.array([M_sun[b] for b in BANDS])
+
+
+def _codes(names, options):
+    """
+    Indices of names (a string, array of strings, or integer codes) 
+    in the list options.
+    """
+    names = np.asarray(names)
+    if names.dtype.kind in 'iu':
+        return names
+    uniq, inverse = np.unique(names, return_inverse=True)
+    for name in uniq:
+        assert name in options, name+' not in '+', '.join(options)
+    lookup = np.array([options.index(name) for name in uniq], dtype=np.intp)
+    return lookup[inverse].reshape(names.shape)
 
 
 class Bell2003(object):
     """
     Estimate stellar masses using the using the mass-to-light ratio/color 
     relation derived from Bell et al. (2003).
+
+    The band and color name can be given per object, as arrays of 
+    names or of integer codes, so a whole catalog is done in one pass. 
+    Band codes are indices into BANDS, as in photometry_pipeline, and 
+    color codes are indices into Bell2003.colors. Bell2003.bands lists 
+    the bands in the table.
     """
 
+    bands = BELL_BANDS
+    colors = BELL_COLORS
+
     def __init__(self):
-        from astropy.io import ascii
-        fn = os.path.join(project_dir, 'data/bell-table.txt')
-        self.table = ascii.read(fn).to_pandas()
-        self.table.set_index('Color', inplace=True)
+        self.coeffs = BELL_COEFFS
+
+    @property
+    def table(self):
+        """Coefficient table as a pandas DataFrame indexed by color."""
+        import pandas as pd
+        columns = [ab+band for band in self.bands for ab in 'ab']
+        return pd.DataFrame(self.coeffs.reshape(len(self.colors), -1), 
+                            index=pd.Index(self.colors, name='Color'),
+                            columns=columns)
+
+    def _bell_index(self, band):
+        index = BELL_BAND_INDEX[_codes(band, BANDS)]
+        assert np.all(index >= 0), 'bands must be in '+', '.join(self.bands)
+        return index
+
+    def log_mass_to_light(self, band, color_name, color):
+        """
+        log10 of the mass-to-light ratio in solar units.
+        """
+        coeffs = self.coeffs[_codes(color_name, self.colors), 
+                             self._bell_index(band)]
+        return coeffs[..., 0] + coeffs[..., 1]*_make_array_if_needed(color)
 
     def mass_to_light(self, band, color_name, color):
-        log_ml = self.table.loc[color_name, 'a'+band] +\
-                 self.table.loc[color_name, 'b'+band]*color
+        log_ml = self.log_mass_to_light(band, color_name, color)
         return (10.0**log_ml)*u.M_sun/u.L_sun
 
     def stellar_mass(self, band, color_name, color, abs_mag):
-        color = _make_array_if_needed(color)
+        band = _codes(band, BANDS)
         abs_mag = _make_array_if_needed(abs_mag)
-        lum = lum_solar_units(abs_mag, band)
-        return lum*self.mass_to_light(band, color_name, color)
+        M_band = M_SUN_BANDS[band]
+        log_ml = self.log_mass_to_light(band, color_name, color)
+        return 10**(0.4*(M_band - abs_mag) + log_ml)*u.M_sun
+
+
+PIPELINE_OUTPUTS = ['abs_mag', 'lum', 'fnu', 'lnu', 'sfr_uv', 'stellar_mass']
+PIPELINE_UNITS = dict(lum=u.L_sun, fnu=u.erg/u.s/u.Hz/u.cm**2, 
+                      lnu=u.erg/u.s/u.Hz, sfr_uv=u.Msun/u.yr, 
+                      stellar_mass=u.M_sun)
+
+
+def photometry_pipeline(outputs, mag=None, abs_mag=None, z=None, band=None,
+                        color_name=None, color=None, dist_mod=None, cosmo=None,
+                        chunk_size=2**20, units=False):
+    """
+    Compute several derived photometric quantities of a catalog in 
+    chunked passes over plain float arrays. Each output is written 
+    into a preallocated array, so the only full-size arrays are the 
+    inputs and outputs, and units are attached at the end (if at all).
+
+    Parameters
+    ----------
+    outputs : list of strings
+        Quantities to compute, from PIPELINE_OUTPUTS:
+        'abs_mag' : absolute magnitude.
+        'lum' : luminosity in L_sun (see lum_solar_units).
+        'fnu' : flux density of mag in erg/s/Hz/cm^2 (see 
+            fnu_from_AB_mag).
+        'lnu' : luminosity density in erg/s/Hz (see lnu_from_AB_mag).
+        'sfr_uv' : UV star formation rate in M_sun/yr (see sfr_uv).
+        'stellar_mass' : Bell et al. (2003) stellar mass in M_sun.
+    mag : ndarray, optional
+        Apparent AB magnitudes. Needed for 'fnu', and with z or 
+        dist_mod for the absolute magnitudes if abs_mag is not given.
+    abs_mag : ndarray, optional
+        Absolute magnitudes.
+    z : ndarray, optional
+        Redshifts.
+    band : string or ndarray, optional
+        Band, or per-row bands as names or integer codes (indices 
+        into BANDS). Needed for 'lum' and 'stellar_mass'.
+    color_name : string or ndarray, optional
+        Bell et al. color name(s), needed for 'stellar_mass'.
+    color : ndarray, optional
+        Color values, needed for 'stellar_mass'.
+    dist_mod : ndarray or callable, optional
+        Distance modulus, or function of z (e.g., DistModTable).
+    cosmo : Cosmology, optional
+        Cosmology for the distance modulus if dist_mod is not given.
+        Default is default_cosmology().
+    chunk_size : int, optional
+        Number of rows per pass.
+    units : bool, optional
+        If True, return astropy Quantities.
+
+    Returns
+    -------
+    results : dict
+        The requested outputs.
+    """
+    for name in outputs:
+        assert name in PIPELINE_OUTPUTS, name+' not in '+', '.join(PIPELINE_OUTPUTS)
+    if abs_mag is None and set(outputs) - set(['fnu']):
+        assert mag is not None, 'must give mag or abs_mag'
+        if dist_mod is None:
+            dist_mod = (default_cosmology() if cosmo is None else cosmo).dist_mod
+        if callable(dist_mod):
+            assert z is not None, 'must give z with a dist_mod function'
+    if 'fnu' in outputs:
+        assert mag is not None, 'fnu needs mag'
+    if 'lum' in outputs or 'stellar_mass' in outputs:
+        assert band is not None, 'must give band'
+        band = _codes(band, BANDS)
+    if 'stellar_mass' in outputs:
+        assert color is not None and color_name is not None, \
+            'stellar_mass needs color and color_name'
+        color_name = _codes(color_name, BELL_COLORS)
+
+    def rows(arr, sl):
+        return arr if np.ndim(arr)==0 else np.asarray(arr)[sl]
+
+    n = max([np.size(arr) for arr in [mag, abs_mag, z, color] if arr is not None])
+    results = dict((name, np.empty(n)) for name in outputs)
+    ln10 = np.log(10.0)
+    for lo in range(0, n, chunk_size):
+        sl = slice(lo, min(lo + chunk_size, n))
+        M = np.empty(sl.stop - sl.start)
+        if abs_mag is not None:
+            M[:] = rows(abs_mag, sl)
+        elif set(outputs) - set(['fnu']):
+            mu = dist_mod(rows(z, sl)) if callable(dist_mod) else rows(dist_mod, sl)
+            np.subtract(rows(mag, sl), mu, out=M)
+        if 'abs_mag' in outputs:
+            results['abs_mag'][sl] = M
+        if 'fnu' in outputs:
+            out = results['fnu'][sl]
+            out[:] = rows(mag, sl)
+            out += mAB_0
+            np.multiply(out, -0.4*ln10, out=out)
+            np.exp(out, out=out)
+        if 'lnu' in outputs or 'sfr_uv' in outputs:
+            lnu = results['lnu'][sl] if 'lnu' in outputs else np.empty(len(M))
+            np.multiply(M + mAB_0, -0.4*ln10, out=lnu)
+            np.exp(lnu, out=lnu)
+            lnu *= AREA_10PC.value
+            if 'sfr_uv' in outputs:
+                np.multiply(lnu, SFR_UV_PER_LNU, out=results['sfr_uv'][sl])
+        if 'lum' in outputs or 'stellar_mass' in outputs:
+            # log10 of the luminosity in L_sun
+            band_rows = rows(band, sl)
+            log_lum = M_SUN_BANDS[band_rows] - M
+            log_lum *= 0.4
+            if 'lum' in outputs:
+                np.multiply(log_lum, ln10, out=results['lum'][sl])
+                np.exp(results['lum'][sl], out=results['lum'][sl])
+            if 'stellar_mass' in outputs:
+                bell_band = BELL_BAND_INDEX[band_rows]
+                assert np.all(bell_band >= 0), \
+                    'bands must be in '+', '.join(BELL_BANDS)
+                coeffs = BELL_COEFFS[rows(color_name, sl), bell_band]
+                log_lum += coeffs[..., 0]
+                log_lum += coeffs[..., 1]*rows(color, sl)
+                log_lum *= ln10
+                np.exp(log_lum, out=results['stellar_mass'][sl])
+    if np.ndim(mag if abs_mag is None else abs_mag)==0:
+        results = dict((name, arr[0]) for name, arr in results.items())
+    if units:
+        for name in outputs:
+            if name in PIPELINE_UNITS:
+                results[name] = results[name]*PIPELINE_UNITS[name]
+    return results
 
 
 def _make_array_if_needed(p):